@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Runs all the benchmarks and writes the results as JSON.
+
+    python -m benchmarks -o results.json
+    python -m benchmarks --only config run --compare results.json
+
+Each result is keyed by its name and parameters (everything except the
+timings), so results from two commits can be compared with `--compare`.
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import platform
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Maps the short name of each benchmark to its module.
+BENCHMARKS = {
+    "import": "benchmarks.bench_import",
+    "config": "benchmarks.bench_config",
+    "run": "benchmarks.bench_run",
+    "newegg_parse": "benchmarks.bench_newegg_parse",
+    "newegg_storage": "benchmarks.bench_newegg_storage",
+    "state": "benchmarks.bench_state",
+}
+
+# Result fields which are measurements, rather than parameters.
+MEASUREMENTS = ("seconds", "per_second", "samples", "heavy_modules")
+
+
+def git_commit() -> Optional[str]:
+    root = Path(__file__).absolute().parent.parent
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root,
+                             check=True, stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.decode().strip()
+
+
+def result_key(result: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(
+        sorted((k, str(v))
+               for k, v in result.items()
+               if not any(k.endswith(m) for m in MEASUREMENTS)))
+
+
+def compare(old: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> None:
+    """Prints how the median time of each matching result changed."""
+
+    old_by_key = {result_key(r): r for r in old}
+    for result in new:
+        prev = old_by_key.get(result_key(result))
+        if prev is None or "median_seconds" not in result:
+            continue
+        ratio = result["median_seconds"] / prev["median_seconds"]
+        params = ", ".join(f"{k}={v}" for k, v in result_key(result)
+                           if k != "name")
+        print(f"{result['name']:<32} {params:<40} {ratio:6.2f}x",
+              file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Runs the benchmarks")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS),
+                        default=list(BENCHMARKS),
+                        help="Benchmarks to run")
+    parser.add_argument("-o", "--output", type=Path, default=None,
+                        help="Where to write the results; defaults to stdout")
+    parser.add_argument("--compare", type=Path, default=None,
+                        help="Earlier results to compare against")
+    args = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+    for name in args.only:
+        print(f"Running {name}", file=sys.stderr)
+        module = importlib.import_module(BENCHMARKS[name])
+        result = module.run_benchmark()  # type: ignore
+        results.extend(result if isinstance(result, list) else [result])
+
+    report = {
+        "commit": git_commit(),
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            compare(json.load(f)["results"], results)
+
+
+if __name__ == "__main__":
+    main()
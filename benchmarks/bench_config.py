@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Benchmarks parsing configs with a growing number of sections.
+
+Each config is a chain of `shell` bots, where every tenth bot depends on
+the one before it, so that the dependency checks have work to do.
+
+    python -m benchmarks.bench_config
+"""
+
+import argparse
+import json
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+from benchmarks.common import summarize, time_call
+from bots.config import parse_config
+
+SIZES = (10, 100, 1000, 10000)
+
+
+def write_config(path: Path, num_sections: int) -> None:
+    with open(path, "w") as f:
+        for i in range(num_sections):
+            f.write(f"[shell-{i}]\ntype = shell\ncommand = true\n"
+                    "cron = hourly\n")
+            if i % 10:
+                f.write(f"depends = [\"shell-{i - 1}\"]\n")
+            f.write("\n")
+
+
+def run_benchmark(
+    num_samples: int = 5,
+    sizes: Sequence[int] = SIZES,
+) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in sizes:
+            cfg_path = Path(tmpdir) / f"bots-{size}.ini"
+            write_config(cfg_path, size)
+
+            def parse() -> None:
+                parse_config.cache_clear()
+                parse_config(cfg_path)
+
+            times = time_call(parse, num_samples)
+            results.append({
+                "name": "parse_config",
+                "sections": size,
+                **summarize(times),
+                "sections_per_second": size / min(times),
+            })
+    parse_config.cache_clear()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Config parsing benchmark")
+    parser.add_argument("-n", "--num-samples", type=int, default=5)
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=SIZES)
+    args = parser.parse_args()
+
+    print(json.dumps(run_benchmark(args.num_samples, args.sizes), indent=2))
+
+
+if __name__ == "__main__":
+    main()
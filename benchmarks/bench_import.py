@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Benchmarks cold-start import time of the cli and cron entry points.
+
+Each sample runs in a fresh interpreter, against a config of `shell` bots
+plus one section of each Flask backend, and checks that none of the heavy
+optional dependencies were imported along the way. The Flask sections
+check that filtering backends by interface doesn't import them.
+
+    python -m benchmarks.bench_import
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import textwrap
+from pathlib import Path
+from typing import Any, Dict, List
+
+HEAVY_MODULES = ["matplotlib", "requests", "lxml", "flask"]
+
+# Code to import and load each entry point.
+ENTRY_POINTS = {
+    "cron_endpoint": textwrap.dedent("""
+        from bots.endpoints.cron_endpoint import get_backends
+        get_backends([])
+    """),
+    "cli": textwrap.dedent("""
+        import sys
+        from bots.endpoints import cli
+        sys.argv = ["cli"]
+        cli.main()
+    """),
+}
+
+SNIPPET = textwrap.dedent("""
+    import json, sys, time
+    start = time.perf_counter()
+    exec({entry!r})
+    elapsed = time.perf_counter() - start
+    heavy = sorted(m for m in {heavy} if m in sys.modules)
+    print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+""")
+
+
+def write_config(path: Path, num_sections: int) -> None:
+    log_dir = path.parent / "logs"
+    with open(path, "w") as f:
+        for i in range(num_sections):
+            f.write(f"[shell-{i}]\ntype = shell\ncommand = true\n"
+                    f"cron = never\nlog_dir = {log_dir}\n\n")
+        f.write(f"[website]\ntype = simple-website\n"
+                f"path = {path.parent / 'index.html'}\n\n")
+        f.write(f"[export]\ntype = newegg-export\n"
+                f"db = {path.parent / 'newegg.db'}\ntable = products\n\n")
+
+
+def sample(cfg_path: Path, state_path: Path, entry: str) -> Dict[str, Any]:
+    env = {
+        **os.environ,
+        "BOTS_CONFIG": str(cfg_path),
+        "BOTS_STATE_CONFIG": str(state_path),
+        "BOTS_METRICS_CONFIG": str(state_path.parent / "metrics.db"),
+    }
+    root = Path(__file__).absolute().parent.parent
+    snippet = SNIPPET.format(entry=ENTRY_POINTS[entry], heavy=HEAVY_MODULES)
+    out = subprocess.run([sys.executable, "-c", snippet], env=env, cwd=root,
+                         check=True, stdout=subprocess.PIPE)
+    # The cli prints the registry first, so the result is the last line.
+    return json.loads(out.stdout.splitlines()[-1])
+
+
+def run_benchmark(num_samples: int = 5,
+                  num_sections: int = 10) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    for entry in ENTRY_POINTS:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cfg_path = Path(tmpdir) / "bots.ini"
+            write_config(cfg_path, num_sections)
+            state_path = Path(tmpdir) / "state.json"
+            samples = [
+                sample(cfg_path, state_path, entry)
+                for _ in range(num_samples)
+            ]
+
+        times: List[float] = [s["seconds"] for s in samples]
+        heavy = sorted({m for s in samples for m in s["heavy"]})
+        results.append({
+            "name": f"import_{entry}",
+            "samples": num_samples,
+            "median_seconds": statistics.median(times),
+            "min_seconds": min(times),
+            "heavy_modules": heavy,
+        })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import time benchmark")
+    parser.add_argument("-n", "--num-samples", type=int, default=5)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.num_samples)
+    print(json.dumps(results, indent=2))
+    for result in results:
+        if result["heavy_modules"]:
+            sys.exit(f"{result['name']} imported {result['heavy_modules']}")
+
+
+if __name__ == "__main__":
+    main()
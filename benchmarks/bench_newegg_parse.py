@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Benchmarks extracting products from a saved Newegg listing page.
+
+The fixture is a 96-item search results page, with the same structure as
+the live site, so that the numbers are reproducible offline.
+
+    python -m benchmarks.bench_newegg_parse
+"""
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from bots.backends.implementations.newegg import parse_listing
+
+FIXTURE = Path(__file__).absolute().parent / "fixtures" / "newegg_listing.html"
+
+
+def run_benchmark(
+    num_samples: int = 5,
+    num_iters: int = 50,
+    fixture: Path = FIXTURE,
+) -> Dict[str, Any]:
+    content = fixture.read_bytes()
+    items, num_pages = parse_listing(content, 0)
+
+    times: List[float] = []
+    for _ in range(num_samples):
+        start = time.perf_counter()
+        for _ in range(num_iters):
+            parse_listing(content, 0)
+        times.append((time.perf_counter() - start) / num_iters)
+
+    return {
+        "name": "newegg_parse_listing",
+        "samples": num_samples,
+        "page_bytes": len(content),
+        "items_per_page": len(items),
+        "num_pages": num_pages,
+        "median_seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "pages_per_second": 1 / statistics.median(times),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Newegg parsing benchmark")
+    parser.add_argument("-n", "--num-samples", type=int, default=5)
+    parser.add_argument("-i", "--num-iters", type=int, default=50)
+    parser.add_argument("-f", "--fixture", type=Path, default=FIXTURE)
+    args = parser.parse_args()
+
+    result = run_benchmark(args.num_samples, args.num_iters, args.fixture)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
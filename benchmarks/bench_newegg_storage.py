@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""Benchmarks Newegg storage and graph queries as the table grows.
+
+The table is filled with synthetic hourly runs up to each size, and then a
+full scrape is run against a local server which serves the listing
+fixture, so the insert path is the same as in production. The queries
+behind the graph backend are timed at each size.
+
+    python -m benchmarks.bench_newegg_storage
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+from benchmarks.common import (FIXTURES, isolated_env, stub_server, summarize,
+                               time_call)
+from bots import analytics
+from bots.backends.implementations import newegg_schema as schema
+from bots.backends.implementations.newegg import (NeweggAvailabilityBackend,
+                                                  parse_listing)
+from bots.utils import Time
+
+SIZES = (10000, 100000, 1000000)
+
+FIXTURE = FIXTURES / "newegg_listing.html"
+
+
+def fill(
+    conn: sqlite3.Connection,
+    table: str,
+    items: List[schema.Item],
+    num_rows: int,
+    start_time: int,
+) -> int:
+    """Adds synthetic hourly runs until the table has `num_rows` rows."""
+
+    rng = random.Random(0)
+    cur = conn.cursor()
+    cur.executemany(f"INSERT OR REPLACE INTO {schema.products_table(table)} "
+                    "VALUES (?, ?)", [(item[1], item[2]) for item in items])
+    num_existing = cur.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    num_runs = (num_rows - num_existing) // len(items)
+    for i in range(num_runs):
+        t = start_time + 3600 * i
+        run = [(t, item[1], item[2], rng.randint(0, 1), item[4])
+               for item in items]
+        cur.executemany(f"INSERT INTO {table} VALUES (?, ?, ?, ?)",
+                        [(r[0], r[1], r[3], r[4]) for r in run])
+        cur.execute(f"INSERT INTO {schema.runs_table(table)} "
+                    "VALUES (?, ?, ?, ?)", (t, len(run), "", 0))
+        schema.update_rollups(conn, table, t, run)
+    conn.commit()
+    return start_time + 3600 * num_runs
+
+
+def next_second() -> None:
+    """Waits for the next second, since runs are keyed by their epoch."""
+
+    time.sleep(1 - time.time() % 1)
+
+
+def run_benchmark(
+    num_samples: int = 3,
+    sizes: Sequence[int] = SIZES,
+    fixture: Path = FIXTURE,
+) -> List[Dict[str, Any]]:
+    content = fixture.read_bytes()
+    items, _ = parse_listing(content, 0)
+
+    results: List[Dict[str, Any]] = []
+    with isolated_env() as tmpdir, stub_server(content) as url:
+        backend = NeweggAvailabilityBackend("bench", {
+            "db": str(tmpdir / "newegg.db"),
+            "table": "products",
+            "search": "[\"1\"]",
+            "max_pages": "1",
+            "request_rate": "1000",
+        })
+        backend.urls = [u.replace("https://newegg.com", url)
+                        for u in backend.urls]
+
+        # Synthetic runs are placed far enough in the past that real runs
+        # always come after them.
+        next_time = Time.epoch() - 3600 * (max(sizes) // len(items) + 1)
+        for size in sizes:
+            next_time = fill(backend.conn, "products", items, size, next_time)
+            conn = backend.conn
+
+            insert_times = time_call(lambda: asyncio.run(backend.run()),
+                                     num_samples, next_second)
+            rollup_times = time_call(
+                lambda: analytics.load_rollup(conn, "products", "hourly"),
+                num_samples)
+            ids = [item[1] for item in items[:5]]
+            history_times = time_call(
+                lambda: analytics.load_history(conn, "products", ids),
+                num_samples)
+            full_times = time_call(
+                lambda: analytics.load_history(conn, "products"),
+                num_samples)
+
+            for name, times in [
+                ("newegg_scrape_and_insert", insert_times),
+                ("newegg_load_rollup", rollup_times),
+                ("newegg_load_history_5_products", history_times),
+                ("newegg_load_history_all", full_times),
+            ]:
+                results.append({"name": name, "rows": size, **summarize(times)})
+        backend.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Newegg storage benchmark")
+    parser.add_argument("-n", "--num-samples", type=int, default=3)
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("-f", "--fixture", type=Path, default=FIXTURE)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.num_samples, args.sizes, args.fixture)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
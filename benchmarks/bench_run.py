@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Benchmarks the runner's scheduling overhead on many dependent bots.
+
+The bots do nothing, so the time measured is the runner itself: building
+the DAG, picking ready bots, and recording state and metrics. Bots are laid
+out in layers, where every bot depends on two bots of the previous layer.
+
+    python -m benchmarks.bench_run
+"""
+
+import argparse
+import asyncio
+import json
+from typing import Any, Dict, List, Sequence
+
+from benchmarks.common import isolated_env, summarize, time_call
+from bots.backends.base import BaseBackend
+from bots.run import Outcome, run
+
+SIZES = (100, 1000)
+
+
+class NoopBackend(BaseBackend):
+    """Returns straight away."""
+
+    async def run(self) -> None:
+        pass
+
+
+def make_backends(num_bots: int, width: int) -> Dict[str, BaseBackend]:
+    backends: Dict[str, BaseBackend] = {}
+    for i in range(num_bots):
+        layer, pos = divmod(i, width)
+        depends: List[str] = []
+        if layer:
+            prev = (layer - 1) * width
+            depends = [f"bot-{prev + pos}", f"bot-{prev + (pos + 1) % width}"]
+        name = f"bot-{i}"
+        backends[name] = NoopBackend(name, {"depends": json.dumps(depends)})
+    return backends
+
+
+def run_benchmark(
+    num_samples: int = 3,
+    sizes: Sequence[int] = SIZES,
+    width: int = 10,
+    max_concurrency: int = 8,
+) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    with isolated_env():
+        for size in sizes:
+            backends = make_backends(size, width)
+            bots = list(backends)
+
+            def run_all() -> None:
+                outcomes = asyncio.run(
+                    run(bots, max_concurrency, backends=backends))
+                assert all(o == Outcome.success for o in outcomes.values())
+
+            times = time_call(run_all, num_samples)
+            results.append({
+                "name": "run_dependent_bots",
+                "bots": size,
+                "width": width,
+                "max_concurrency": max_concurrency,
+                **summarize(times),
+                "bots_per_second": size / min(times),
+            })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Runner benchmark")
+    parser.add_argument("-n", "--num-samples", type=int, default=3)
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("-w", "--width", type=int, default=10)
+    parser.add_argument("-j", "--max-concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.num_samples, args.sizes, args.width,
+                            args.max_concurrency)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
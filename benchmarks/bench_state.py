@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Benchmarks writing bot state and saving it, for each storage backend.
+
+    python -m benchmarks.bench_state
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+from benchmarks.common import summarize
+from bots.state import _State
+
+SIZES = (100, 1000, 10000)
+
+
+def run_benchmark(
+    num_samples: int = 3,
+    sizes: Sequence[int] = SIZES,
+) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    for suffix in (".db", ".json"):
+        for size in sizes:
+            set_times: List[float] = []
+            save_times: List[float] = []
+            for sample in range(num_samples):
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    state = _State(_State.open(Path(tmpdir) / f"s{suffix}"))
+                    start = time.perf_counter()
+                    for i in range(size):
+                        state.set(f"bot-{i % 100}", f"key-{i}", str(sample))
+                    set_times.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    state.save()
+                    save_times.append(time.perf_counter() - start)
+            results.append({
+                "name": "state_set_and_save",
+                "backend": suffix.lstrip("."),
+                "keys": size,
+                **summarize([a + b for a, b in zip(set_times, save_times)]),
+                "median_set_seconds": statistics.median(set_times),
+                "median_save_seconds": statistics.median(save_times),
+            })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="State store benchmark")
+    parser.add_argument("-n", "--num-samples", type=int, default=3)
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=SIZES)
+    args = parser.parse_args()
+
+    print(json.dumps(run_benchmark(args.num_samples, args.sizes), indent=2))
+
+
+if __name__ == "__main__":
+    main()
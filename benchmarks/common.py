@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""Helpers shared by the benchmarks."""
+
+import contextlib
+import os
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+FIXTURES = Path(__file__).absolute().parent / "fixtures"
+
+
+def summarize(times: List[float]) -> Dict[str, Any]:
+    """Summarizes the per-sample times, in seconds."""
+
+    return {
+        "samples": len(times),
+        "median_seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "max_seconds": max(times),
+    }
+
+
+def time_call(
+    fn: Callable[[], Any],
+    num_samples: int,
+    setup: Optional[Callable[[], Any]] = None,
+) -> List[float]:
+    """Times `fn`, returning the duration of each call.
+
+    Args:
+        fn: The function to time
+        num_samples: The number of times to call it
+        setup: If set, called before each call, outside the timing
+    """
+
+    times: List[float] = []
+    for _ in range(num_samples):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+@contextlib.contextmanager
+def isolated_env() -> Iterator[Path]:
+    """Points the state and metrics stores at a temporary directory.
+
+    The state singletons are reset on entry and exit, so that benchmarks
+    never touch the real stores.
+    """
+
+    from bots.metrics import METRICS
+    from bots.state import STATE
+
+    keys = ["BOTS_STATE_CONFIG", "BOTS_METRICS_CONFIG"]
+    old_env = {k: os.environ.get(k) for k in keys}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["BOTS_STATE_CONFIG"] = str(Path(tmpdir) / "state.db")
+        os.environ["BOTS_METRICS_CONFIG"] = str(Path(tmpdir) / "metrics.db")
+        type(STATE).path.cache_clear()
+        type(METRICS).path.cache_clear()
+        STATE._backend, METRICS._history = None, None
+        try:
+            yield Path(tmpdir)
+        finally:
+            STATE._backend, METRICS._history = None, None
+            for k, v in old_env.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            type(STATE).path.cache_clear()
+            type(METRICS).path.cache_clear()
+
+
+@contextlib.contextmanager
+def stub_server(body: bytes) -> Iterator[str]:
+    """Serves `body` for every GET request on a local port.
+
+    Yields:
+        The base URL of the server
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
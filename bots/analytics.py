@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""Vectorized analytics over the scraped product history.
+
+Rows are loaded straight into NumPy arrays, sorted by product and time, so
+that per-product statistics are computed with segmented reductions instead
+of Python loops. Rows are treated as change points: each one holds until
+the next row for the same product. That matches delta storage, where a
+product going away is written as a delisted row. Full storage never writes
+delisted rows; a product that drops out of a search just has no rows until
+it comes back, so a row there holds across the gap, and the time-based
+statistics count the gap as listed time.
+"""
+
+import sqlite3
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from bots.backends.implementations import newegg_schema as schema
+
+
+class History:
+    """Holds the rows of a product table as column arrays.
+
+    The rows are sorted by product, then time. `ids[codes[i]]` is the
+    product ID of row `i`, and `starts[j]` is the first row of product `j`.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        codes: np.ndarray,
+        time: np.ndarray,
+        in_stock: np.ndarray,
+        price: np.ndarray,
+    ) -> None:
+        self.ids = ids
+        self.codes = codes
+        self.time = time
+        self.in_stock = in_stock
+        self.price = price
+
+        boundaries = np.flatnonzero(np.diff(codes)) + 1
+        self.starts = np.concatenate([[0], boundaries]).astype(np.int64) \
+            if len(codes) else np.zeros(0, dtype=np.int64)
+        self.counts = np.diff(np.append(self.starts, len(codes)))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def listed(self) -> np.ndarray:
+        """Mask of rows where the product is listed."""
+
+        return self.in_stock != schema.DELISTED
+
+    @property
+    def is_last(self) -> np.ndarray:
+        """Mask of the last row of each product."""
+
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.starts + self.counts - 1] = True
+        return mask
+
+    def durations(self, until: Optional[int] = None) -> np.ndarray:
+        """Gets how long each row's values held.
+
+        Args:
+            until: The end time for each product's last row; defaults to the
+                latest time in the history
+
+        Returns:
+            The number of seconds until the product's next row
+        """
+
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        if until is None:
+            until = int(self.time.max())
+        next_time = np.append(self.time[1:], until)
+        next_time[self.is_last] = until
+        return np.maximum(next_time - self.time, 0)
+
+
+def load_history(
+    conn: sqlite3.Connection,
+    table: str,
+    ids: Optional[Sequence[str]] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    chunk_size: int = 65536,
+) -> History:
+    """Loads rows from a product table into arrays.
+
+    The rows are read with `fetchmany`, so only one chunk of Python tuples
+    is alive at a time, and the query walks the `(id, time)` primary key.
+
+    Args:
+        conn: The database connection
+        table: The base table name
+        ids: If set, only load these products
+        since: If set, only load rows at or after this epoch time
+        until: If set, only load rows before this epoch time
+        chunk_size: The number of rows to fetch at a time
+
+    Returns:
+        The loaded history
+    """
+
+    conditions: List[str] = []
+    params: List[object] = []
+    if ids is not None:
+        conditions.append(f"id IN ({', '.join('?' * len(ids))})")
+        params.extend(ids)
+    if since is not None:
+        conditions.append("time >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("time < ?")
+        params.append(until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT id, time, in_stock, price
+        FROM {table}
+        {where}
+        ORDER BY id, time
+    """, params)
+
+    id_list: List[str] = []
+    code_chunks: List[np.ndarray] = []
+    time_chunks: List[np.ndarray] = []
+    stock_chunks: List[np.ndarray] = []
+    price_chunks: List[np.ndarray] = []
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        id_col, time_col, stock_col, price_col = zip(*rows)
+
+        # Rows are sorted by ID, so new IDs only ever get appended.
+        id_arr = np.asarray(id_col, dtype=object)
+        is_new = np.empty(len(rows), dtype=bool)
+        is_new[0] = not id_list or id_list[-1] != id_arr[0]
+        is_new[1:] = id_arr[1:] != id_arr[:-1]
+        codes = len(id_list) - 1 + np.cumsum(is_new, dtype=np.int64)
+        id_list.extend(id_arr[is_new].tolist())
+
+        code_chunks.append(codes.astype(np.int32))
+        time_chunks.append(np.asarray(time_col, dtype=np.int64))
+        stock_chunks.append(np.asarray(stock_col, dtype=np.int8))
+        price_chunks.append(np.asarray(price_col, dtype=np.float64))
+
+    def concat(chunks: List[np.ndarray], dtype: type) -> np.ndarray:
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=dtype)
+
+    return History(
+        ids=id_list,
+        codes=concat(code_chunks, np.int32),
+        time=concat(time_chunks, np.int64),
+        in_stock=concat(stock_chunks, np.int8),
+        price=concat(price_chunks, np.float64),
+    )
+
+
+def load_rollup(
+    conn: sqlite3.Connection,
+    table: str,
+    resolution: str = "run",
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Loads the average stock and price for each rollup bucket.
+
+    Returns:
+        The bucket times, the fraction of listed items in stock and the
+        average price
+    """
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT time, items, in_stock, price
+        FROM {schema.rollup_table(table, resolution)}
+        WHERE items > 0
+        ORDER BY time
+    """)
+    rows = np.array(cur.fetchall(), dtype=np.float64).reshape(-1, 4)
+    items = rows[:, 1]
+    return rows[:, 0].astype(np.int64), rows[:, 2] / items, rows[:, 3] / items
+
+
+def price_range(history: History) -> Tuple[np.ndarray, np.ndarray]:
+    """Gets the minimum and maximum listed price of each product."""
+
+    if not len(history):
+        return np.zeros(0), np.zeros(0)
+    price = np.where(history.listed, history.price, np.nan)
+    lo = np.fmin.reduceat(price, history.starts)
+    hi = np.fmax.reduceat(price, history.starts)
+    return lo, hi
+
+
+def moving_average(history: History, window: int) -> np.ndarray:
+    """Gets the moving average price over each product's last listed rows.
+
+    Rows where the product is delisted are left out of the averages, and
+    get NaN. Windows don't cross between products, so the first rows of
+    each product average over fewer rows. In delta storage, rows are price
+    and stock changes rather than runs, so the window counts changes.
+
+    Args:
+        history: The loaded history
+        window: The number of listed rows to average over
+
+    Returns:
+        The moving average price at each row
+    """
+
+    if not len(history):
+        return np.zeros(0)
+    listed = history.listed
+    price = history.price[listed]
+    listed_history = History(history.ids, history.codes[listed],
+                             history.time[listed], history.in_stock[listed],
+                             price)
+    csum = np.cumsum(price)
+    group_start = np.repeat(listed_history.starts, listed_history.counts)
+    index = np.arange(len(price))
+    lo = np.maximum(index - window + 1, group_start)
+    prev = np.where(lo > 0, csum[np.maximum(lo - 1, 0)], 0.0)
+    average = np.full(len(history), np.nan)
+    average[listed] = (csum - prev) / (index - lo + 1)
+    return average
+
+
+def percent_in_stock(
+    history: History,
+    until: Optional[int] = None,
+) -> np.ndarray:
+    """Gets the percent of listed time each product was in stock.
+
+    Returns:
+        The percentage for each product, or NaN if it was never listed
+    """
+
+    if not len(history):
+        return np.zeros(0)
+    durations = history.durations(until).astype(np.float64)
+    listed = np.where(history.listed, durations, 0.0)
+    stocked = np.where(history.in_stock == 1, durations, 0.0)
+    listed_time = np.add.reduceat(listed, history.starts)
+    stocked_time = np.add.reduceat(stocked, history.starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return 100.0 * stocked_time / listed_time
+
+
+def restock_intervals(history: History) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds how long each product stayed out of stock before restocking.
+
+    Returns:
+        The product code and the out-of-stock duration, in seconds, of each
+        restock
+    """
+
+    if len(history) < 2:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+
+    stock = history.in_stock
+    same_product = history.codes[1:] == history.codes[:-1]
+    changed = np.concatenate([[True], (stock[1:] != stock[:-1]) |
+                              ~same_product])
+
+    # Only keeps rows where the stock status changed, then finds pairs of
+    # going out of stock followed by coming back in stock.
+    idx = np.flatnonzero(changed)
+    codes, times, states = history.codes[idx], history.time[idx], stock[idx]
+    restock = (states[1:] == 1) & (states[:-1] == 0) & \
+        (codes[1:] == codes[:-1])
+    return codes[1:][restock], times[1:][restock] - times[:-1][restock]
@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 
+import contextlib
 import json
 import textwrap
+import threading
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional
 
 from termcolor import colored
 
@@ -14,14 +16,54 @@ class BaseBackend(ABC):
     The config is the parsed config, as a dictionary. Subclasses should pop
     the relevant keys before calling super().__init__(config). This helps check
     that there aren't typos in the config.
+
+    Backends whose `run` blocks (for example, by doing synchronous network
+    or disk IO) should set `blocking`, so that the runner moves them off the
+    event loop. `max_concurrency` caps how many backends of one type can run
+    at the same time.
+
+    Backends which write rows somewhere can set `rows_written` during a run,
+    and it's recorded with the run's metrics.
+
+    After a successful run, the runner publishes `output_version` to the
+    state. A backend can list the upstream backends whose outputs it
+    consumes in `inputs`; if none of their versions changed since its last
+    successful run, it is skipped.
+
+    `interface` names the endpoint which runs the backend, `cron` or
+    `flask`; it is also listed in the registry manifest, so that endpoints
+    can pick their backends without importing the others.
+
+    Runs and requests hold the backend with `in_use`. When it's removed
+    from the config it is retired, and closed once nothing is using it.
     """
 
+    interface: Optional[str] = None
+    blocking: bool = False
+    max_concurrency: Optional[int] = None
+
     def __init__(self, name: str, config: Dict[str, str]) -> None:
         """Builds the backend using its associated config."""
 
         self.name = name
         self.depends: List[str] = json.loads(config.pop("depends", "[]"))
 
+        # Parses the dependencies whose outputs this backend consumes.
+        self.inputs: List[str] = json.loads(config.pop("inputs", "[]"))
+        not_depends = [i for i in self.inputs if i not in self.depends]
+        if not_depends:
+            raise ValueError(f"Inputs must also be in `depends`: {not_depends}")
+
+        # Parses the maximum run time, in seconds.
+        timeout = config.pop("timeout", None)
+        self.timeout = None if timeout is None else float(timeout)
+
+        self.rows_written: Optional[int] = None
+
+        self._users = 0
+        self._retired = False
+        self._users_lock = threading.Lock()
+
         if config:
             raise ValueError(f"Unexpected config keys: {list(config.keys())}")
 
@@ -29,10 +71,53 @@ class BaseBackend(ABC):
     async def run(self) -> None:
         """Runs the backend."""
 
+    def output_version(self) -> Optional[str]:
+        """Identifies the data this backend produced, after a run.
+
+        This should change whenever the output changes, and stay the same
+        otherwise, for example a content hash or a row count and time.
+        """
+
+        return None
+
+    def close(self) -> None:
+        """Releases any resources held by the backend.
+
+        This is called by the runner after each run, and when the backend is
+        retired, so it should be safe to call more than once.
+        """
+
+    @contextlib.contextmanager
+    def in_use(self) -> Iterator[None]:
+        """Keeps the backend from being closed by `retire` while in use."""
+
+        with self._users_lock:
+            self._users += 1
+        try:
+            yield
+        finally:
+            with self._users_lock:
+                self._users -= 1
+                if self._retired and not self._users:
+                    self.close()
+
+    def retire(self) -> None:
+        """Closes the backend now, or after the runs still using it."""
+
+        with self._users_lock:
+            self._retired = True
+            if not self._users:
+                self.close()
+
     def props(self) -> Dict[str, Any]:
         """Gets properties for this backend."""
 
-        return {}
+        props: Dict[str, Any] = {}
+        if self.timeout is not None:
+            props["timeout"] = self.timeout
+        if self.inputs:
+            props["inputs"] = self.inputs
+        return props
 
     @classmethod
     def help(cls) -> str:
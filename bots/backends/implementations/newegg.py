@@ -1,21 +1,119 @@
 #!/usr/bin/env python
 
+import asyncio
+import functools
+import hashlib
 import json
 import logging
 import re
 import sqlite3
+import threading
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-import matplotlib.pyplot as plt
-import requests
+from bots.backends.implementations import newegg_schema as schema
+from bots.backends.implementations.newegg_schema import DELISTED, Item
 from bots.backends.interfaces.cron_interface import CronBackend
 from bots.backends.registry import register
+from bots.http_client import RateLimiter, get_client
+from bots.state import STATE
 from bots.utils import Time
-from lxml import html
 
 logger = logging.getLogger(__name__)
 
+# The items on a page, and the total number of pages.
+Page = Tuple[List[Item], int]
+
+PRODUCT_ID_RE = re.compile(r"/p/([\w\d]+)")
+PRICE_RE = re.compile(r"[\d,]+\.\d+")
+NUM_PAGES_RE = re.compile(r"\d+\s*/\s*(\d+)")
+
+
+@functools.lru_cache(None)
+def _selectors() -> Tuple[Any, Any]:
+    # Imported here, since it is slow to import and only needed when
+    # actually scraping.
+    from lxml import etree
+
+    items = etree.XPath("//div[contains(@class, 'item-container')]")
+    pages = etree.XPath("//span[contains(@class, "
+                        "'list-tool-pagination-text')]")
+    return items, pages
+
+
+_PARSERS = threading.local()
+
+
+def _parser() -> Any:
+    # Parsers aren't thread-safe, and pages are parsed on executor threads.
+    if not hasattr(_PARSERS, "parser"):
+        from lxml import etree
+
+        _PARSERS.parser = etree.HTMLParser(remove_comments=True)
+    return _PARSERS.parser
+
+
+def _text(element: Any) -> str:
+    return "".join(element.itertext())
+
+
+def parse_listing(content: bytes, time: int) -> Page:
+    """Parses the products from a Newegg search results page.
+
+    Each item container is walked once, picking out the title link, the
+    promo text and the current price as they are encountered.
+
+    Args:
+        content: The raw HTML of the page
+        time: The epoch time to record for each item
+
+    Returns:
+        The parsed items, and the total number of result pages
+    """
+
+    from lxml import etree
+
+    items_xpath, pages_xpath = _selectors()
+    tree = etree.fromstring(content, _parser())
+
+    # Gets the number of pages, from text like "1/12".
+    num_pages = 1
+    for span in pages_xpath(tree):
+        match = NUM_PAGES_RE.search(_text(span))
+        if match:
+            num_pages = int(match.group(1))
+
+    all_items: List[Item] = []
+    for container in items_xpath(tree):
+        name: Optional[str] = None
+        id_str: Optional[str] = None
+        price: Optional[float] = None
+        out_of_stock = False
+
+        for element in container.iter("a", "p", "li"):
+            cls = element.get("class")
+            if cls is None:
+                continue
+            if element.tag == "a":
+                if name is None and "item-title" in cls:
+                    name = _text(element)
+                    ids = PRODUCT_ID_RE.findall(element.get("href", ""))
+                    id_str = ids[0] if ids else None
+            elif element.tag == "p":
+                if "item-promo" in cls and _text(element) == "OUT OF STOCK":
+                    out_of_stock = True
+            elif price is None and "price-current" in cls:
+                match = PRICE_RE.search(_text(element))
+                if match:
+                    price = float(match.group(0).replace(",", ""))
+
+        if name is None or id_str is None or price is None:
+            continue
+        in_stock = 0 if out_of_stock else 1
+        all_items += [(time, id_str, name, in_stock, price)]
+
+    return all_items, num_pages
+
 
 class NeweggBackend(CronBackend):
     def __init__(self, name: str, config: Dict[str, str]) -> None:
@@ -27,66 +125,59 @@ class NeweggBackend(CronBackend):
         self.table: str = config["table"]
         config.pop("table")
 
+        # The connection is opened on first use.
         self._conn: Optional[sqlite3.Connection] = None
-        self.connect()
+        self._conn_lock = threading.Lock()
 
         super().__init__(name, config)
 
-    def connect(self) -> None:
+    def connect(self) -> sqlite3.Connection:
         if not self.db.exists():
             self.db.parent.mkdir(parents=True, exist_ok=True)
 
-        self._conn = sqlite3.connect(self.db)
-        cur = self.conn.cursor()
-
-        cur.execute(f"""
-            CREATE TABLE IF NOT EXISTS {self.table} (
-                time text NOT NULL,
-                id text NOT NULL,
-                name text NOT NULL,
-                in_stock integer NOT NULL,
-                price float NOT NULL
-            );
-        """)
-
-        cur.execute(f"""
-            CREATE UNIQUE INDEX IF NOT EXISTS {self.table}_index
-            ON {self.table}(time, id)
-        """)
+        conn = sqlite3.connect(self.db, check_same_thread=False)
+        schema.create_tables(conn, self.table)
+        return conn
 
-        cur.execute(f"""
-            CREATE TABLE IF NOT EXISTS {self.exception_table} (
-                time text NOT NULL,
-                exception text NOT NULL
-            )
-        """)
+    @property
+    def exception_table(self) -> str:
+        return schema.exception_table(self.table)
 
-        cur.execute(f"""
-            CREATE UNIQUE INDEX IF NOT EXISTS {self.exception_table}_index
-            ON {self.exception_table}(time)
-        """)
+    @property
+    def runs_table(self) -> str:
+        return schema.runs_table(self.table)
 
     @property
-    def exception_table(self) -> str:
-        return f"{self.table}_exceptions"
+    def products_table(self) -> str:
+        return schema.products_table(self.table)
 
     @property
     def conn(self) -> sqlite3.Connection:
-        conn = self._conn
-        assert conn is not None
-        return conn
+        with self._conn_lock:
+            if self._conn is None:
+                self._conn = self.connect()
+            return self._conn
+
+    def close(self) -> None:
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
 
     def __del__(self) -> None:
-        if self._conn is not None:
-            self._conn.close()
+        if getattr(self, "_conn", None) is not None:
+            self.close()
 
     def log_exception(self, exception: str) -> None:
-        time = Time.get()
+        time = Time.epoch()
         cur = self.conn.cursor()
-        cur.execute(f"INSERT INTO {self.exception_table} (?, ?)",
+        cur.execute(f"INSERT INTO {self.exception_table} VALUES (?, ?)",
                     (time, exception))
         self.conn.commit()
 
+    def iter_snapshots(self) -> Iterator[Tuple[int, List[Item]]]:
+        return schema.iter_snapshots(self.conn, self.table)
+
     def props(self) -> Dict[str, Any]:
         return {**super().props(), "db": self.db, "table": self.table}
 
@@ -96,7 +187,21 @@ class NeweggAvailabilityBackend(NeweggBackend):
     """Checks availability of products on Newegg and saves to an SQLite table.
 
     The product search parameters should be specified as a JSON list. They are
-    joined with `%` to get the N parameter for the URL.
+    joined with `%` to get the N parameter for the URL. To cover several
+    searches in one bot, give a list of such lists instead.
+
+    Every page of each search is fetched, up to `max_pages` per search, with
+    at most `max_requests` requests in flight and `request_rate` requests
+    started per second. All rows from one run are inserted together. If
+    any page can't be fetched, the run fails without storing anything, so
+    that a partial listing isn't recorded as the run's snapshot, and in
+    delta mode the products on the missing pages aren't marked delisted.
+
+    If `storage` is `delta`, a run whose products are identical to the
+    previous run's stores nothing but the run itself, and otherwise only
+    the products whose name, price or stock changed are stored, along with
+    rows marking products which are no longer listed. `iter_snapshots`
+    rebuilds the full listing at each run.
     """
 
     def __init__(self, name: str, config: Dict[str, str]) -> None:
@@ -104,115 +209,289 @@ class NeweggAvailabilityBackend(NeweggBackend):
         search = json.loads(config["search"])
         assert isinstance(search, list), search
         config.pop("search")
+        if all(isinstance(s, str) for s in search):
+            search = [search]
+        assert all(isinstance(s, list) for s in search), search
+        self.urls = [
+            f"https://newegg.com/p/pl?N={'%'.join(s)}&PageSize=96"
+            for s in search
+        ]
 
-        self.url = f"https://newegg.com/p/pl?N={'%'.join(search)}&PageSize=96"
+        # Parses the request limits.
+        self.max_pages = int(config.pop("max_pages", "20"))
+        self.max_requests = int(config.pop("max_requests", "4"))
+        self.request_rate = float(config.pop("request_rate", "2"))
 
-        super().__init__(name, config)
+        # Parses the storage mode.
+        storage = config.pop("storage", "full")
+        if storage not in ("full", "delta"):
+            raise ValueError(f"Invalid storage mode: {storage}")
+        self.delta = storage == "delta"
+        self._last_known: Optional[Dict[str, Item]] = None
 
-    async def run(self) -> None:
-        time = Time.get()
+        super().__init__(name, config)
 
-        response = requests.get(self.url)
-        if response.status_code != 200:
-            self.log_exception(f"Got status code: {response.status_code}")
-            return
+    @property
+    def last_known(self) -> Dict[str, Item]:
+        """The latest stored row for each listed product."""
+
+        if self._last_known is None:
+            cur = self.conn.cursor()
+            cur.execute(f"""
+                SELECT t.time, t.id, p.name, t.in_stock, t.price
+                FROM {self.table} AS t
+                JOIN (
+                    SELECT id, max(time) AS time
+                    FROM {self.table}
+                    GROUP BY id
+                ) AS latest
+                ON t.id = latest.id AND t.time = latest.time
+                JOIN {self.products_table} AS p ON t.id = p.id
+                WHERE t.in_stock != ?
+            """, (DELISTED,))
+            self._last_known = {row[1]: row for row in cur}
+        return self._last_known
+
+    def last_content_hash(self) -> Optional[str]:
+        cur = self.conn.cursor()
+        cur.execute(f"""
+            SELECT content_hash FROM {self.runs_table}
+            ORDER BY time DESC LIMIT 1
+        """)
+        row = cur.fetchone()
+        return None if row is None else row[0]
 
-        tree = html.fromstring(response.content)
-        elements = tree.xpath("//div[contains(@class, 'item-container')]")
+    def output_version(self) -> Optional[str]:
+        # Every run adds a data point to the rollups, even if the listing
+        # didn't change, so the version changes with each stored run.
+        cur = self.conn.cursor()
+        cur.execute(f"""
+            SELECT time, content_hash FROM {self.runs_table}
+            ORDER BY time DESC LIMIT 1
+        """)
+        row = cur.fetchone()
+        return None if row is None else f"{row[0]}:{row[1]}"
 
-        # Gets item names.
-        names = [
-            [
-                (p.text_content(), re.findall(r"/p/([\w\d]+)", p.get("href")))
-                for p in element.xpath(".//a[contains(@class, 'item-title')]")
-            ] for element in elements
-        ]
+    def changed_items(self, time: int, items: List[Item]) -> List[Item]:
+        """Gets the rows to store in delta mode."""
 
-        # Checks if the item is out of stock.
-        out_of_stocks = [
-            any(
-                p.text_content() == "OUT OF STOCK"
-                for p in element.xpath(".//p[contains(@class, 'item-promo')]")
-            ) for element in elements
+        last_known = self.last_known
+        changed = [
+            item for item in items
+            if item[1] not in last_known or last_known[item[1]][2:] != item[2:]
         ]
-
-        # Checks the item price.
-        prices = [
-            [float(p.replace(",", "")) for p in price_list]
-            for element in elements
-            for price_list in [
-                re.findall(r"[\d,]+\.\d+", p.text_content()) for p in
-                element.xpath(".//li[contains(@class, 'price-current')]")
-            ]
+        listed = {item[1] for item in items}
+        changed += [
+            (time, id_str, item[2], DELISTED, item[4])
+            for id_str, item in last_known.items() if id_str not in listed
         ]
+        return changed
+
+    async def fetch(
+        self,
+        url: str,
+        time: int,
+        limiter: RateLimiter,
+    ) -> Optional[Page]:
+        async with limiter.acquire():
+            try:
+                response = await get_client().get(url, conditional=True)
+            except Exception as exp:
+                self.log_exception(f"{url}: {exp!r}")
+                return None
+        if response.status != 200 and not response.not_modified:
+            self.log_exception(f"{url}: Got status code: {response.status}")
+            return None
+
+        # Parses the page off the event loop, since it is CPU-bound.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, parse_listing,
+                                          response.content, time)
+
+    async def fetch_search(
+        self,
+        url: str,
+        time: int,
+        limiter: RateLimiter,
+    ) -> Optional[List[Item]]:
+        """Gets the items on every page of a search, or None if any failed."""
+
+        first_page = await self.fetch(url, time, limiter)
+        if first_page is None:
+            return None
+        items, num_pages = first_page
+
+        # Fetches the remaining pages concurrently.
+        pages = await asyncio.gather(*[
+            self.fetch(f"{url}&page={page}", time, limiter)
+            for page in range(2, min(num_pages, self.max_pages) + 1)
+        ])
+        for page in pages:
+            if page is None:
+                return None
+            items += page[0]
+        return items
 
-        # Sanitizes all the gross XPath outputs.
-        all_items = []
-        for name, out_of_stock, price in zip(names, out_of_stocks, prices):
-            if not name:
-                continue
-            name_str, ids = name[0]
-            if not ids:
-                continue
-            id_str = ids[0]
-            in_stock = 0 if out_of_stock else 1
-            if not price:
-                continue
-            price_str = price[0]
-            all_items += [(time, id_str, name_str, in_stock, price_str)]
+    async def run(self) -> None:
+        time = Time.epoch()
+
+        limiter = RateLimiter(self.max_requests, self.request_rate)
+        searches = await asyncio.gather(*[
+            self.fetch_search(url, time, limiter) for url in self.urls
+        ])
+        num_failed = sum(items is None for items in searches)
+        if num_failed:
+            raise RuntimeError(f"{num_failed} of {len(searches)} searches "
+                               f"failed for {self.name}; see "
+                               f"{self.exception_table}")
+
+        # The same product can show up in several searches or pages.
+        all_items = list({
+            item[1]: item
+            for items in searches if items is not None
+            for item in items
+        }.values())
+        all_items.sort(key=lambda item: item[1])
+
+        content_hash = hashlib.sha256(json.dumps(
+            [item[1:] for item in all_items]).encode("utf-8")).hexdigest()
+        if not self.delta:
+            rows = all_items
+        elif content_hash == self.last_content_hash():
+            rows = []
+        else:
+            rows = self.changed_items(time, all_items)
 
         cur = self.conn.cursor()
-        cur.executemany(f"INSERT INTO {self.table} VALUES (?, ?, ?, ?, ?)",
-                        all_items)
+        cur.executemany(f"""
+            INSERT INTO {self.products_table} VALUES (?, ?)
+            ON CONFLICT (id) DO UPDATE SET name = excluded.name
+            WHERE name != excluded.name
+        """, [(row[1], row[2]) for row in rows])
+        cur.executemany(f"INSERT INTO {self.table} VALUES (?, ?, ?, ?)",
+                        [(row[0], row[1], row[3], row[4]) for row in rows])
+        cur.execute(f"INSERT INTO {self.runs_table} VALUES (?, ?, ?, ?)",
+                    (time, len(all_items), content_hash, int(self.delta)))
+        schema.update_rollups(self.conn, self.table, time, all_items)
         self.conn.commit()
 
-        logger.info("Inserted %d rows", len(all_items))
+        if self.delta and rows:
+            self._last_known = {item[1]: item for item in all_items}
+
+        self.rows_written = len(rows)
+        logger.info("Inserted %d rows for %d items", len(rows), len(all_items))
 
     def props(self) -> Dict[str, Any]:
-        return {**super().props(), "url": self.url}
+        return {**super().props(), "urls": self.urls}
 
 
 @register("newegg-availability-graph")
 class NeweggAvailabilityGraphBackend(NeweggBackend):
     """Creates a graph of product availability and prices.
 
-    This simply reads from the table that is created by `newegg-availability`
-    task and plots the price and availability over time.
+    This reads the rollups of the table that is created by the
+    `newegg-availability` task and plots the average price and availability
+    over time. `resolution` picks the rollup to plot: `run` (the default),
+    `hourly` or `daily`. The graph is only redrawn when there are new runs.
+
+    To also plot the moving average price of specific products, give their
+    IDs as a JSON list in `products`, and the number of rows to average over
+    in `window`. Delisted rows are left out. Rows are runs in full storage,
+    and price or stock changes in delta storage, so the window counts those.
     """
 
+    # Pyplot keeps global state, so graphs can't be drawn concurrently.
+    blocking = True
+    max_concurrency = 1
+
     def __init__(self, name: str, config: Dict[str, str]) -> None:
         # Parses the graph path.
         self.graph = Path(config["graph"])
         config.pop("graph")
 
+        # Parses the rollup resolution.
+        self.resolution = config.pop("resolution", "run")
+        if self.resolution not in schema.ROLLUPS:
+            raise ValueError(f"Invalid resolution: {self.resolution}")
+
+        # Parses the products to plot individually.
+        self.products: List[str] = json.loads(config.pop("products", "[]"))
+        self.window = int(config.pop("window", "24"))
+
         super().__init__(name, config)
 
-    async def run(self) -> None:
+    def row_unit(self) -> str:
+        """Says what a row of the table stands for, for labelling windows."""
+
         cur = self.conn.cursor()
+        cur.execute(f"SELECT min(delta), max(delta) FROM {self.runs_table}")
+        min_delta, max_delta = cur.fetchone()
+        if not max_delta:
+            return "run"
+        return "change" if min_delta else "row"
 
-        cur.execute(f"""
-            SELECT time, avg(in_stock), avg(price)
-            FROM {self.table}
-            GROUP BY time
-        """)
+    def watermark(self) -> Optional[str]:
+        """Identifies the latest run in the rollups."""
 
-        rows = cur.fetchall()
-        time, in_stock, price = zip(*rows)
-        time, in_stock, price = list(time), list(in_stock), list(price)
-        time = [Time.parse(t) for t in time]
+        cur = self.conn.cursor()
+        run_table = schema.rollup_table(self.table, "run")
+        cur.execute(f"SELECT max(time), count(*) FROM {run_table}")
+        last_time, num_runs = cur.fetchone()
+        return None if last_time is None else f"{last_time}:{num_runs}"
+
+    async def run(self) -> None:
+        watermark = self.watermark()
+        last_watermark = STATE.get(self.name, "watermark", default=None)
+        if self.graph.exists() and watermark == last_watermark:
+            logger.info("No new data for %s; skipping", self.graph)
+            return
+
+        # Imported here, since NumPy and Matplotlib are slow to import.
+        import matplotlib.pyplot as plt
+        from bots import analytics
 
-        plt.figure(figsize=(16, 8))
+        times, in_stock, price = analytics.load_rollup(self.conn, self.table,
+                                                       self.resolution)
+        time = [Time.from_epoch(t) for t in times.tolist()]
+        num_plots = 3 if self.products else 2
 
-        plt.subplot(2, 1, 1)
+        plt.figure(figsize=(16, 4 * num_plots))
+
+        plt.subplot(num_plots, 1, 1)
         plt.scatter(time, in_stock)
         plt.title("In Stock")
         plt.gcf().autofmt_xdate()
 
-        plt.subplot(2, 1, 2)
+        plt.subplot(num_plots, 1, 2)
         plt.scatter(time, price)
         plt.title("Price")
         plt.gcf().autofmt_xdate()
 
+        if self.products:
+            history = analytics.load_history(self.conn, self.table,
+                                             ids=self.products)
+            average = analytics.moving_average(history, self.window)
+            listed = history.listed
+            plt.subplot(num_plots, 1, 3)
+            for code, id_str in enumerate(history.ids):
+                mask = (history.codes == code) & listed
+                product_time = [
+                    Time.from_epoch(t) for t in history.time[mask].tolist()
+                ]
+                plt.step(product_time, average[mask], where="post",
+                         label=id_str)
+            plt.legend()
+            plt.title(f"Price ({self.window}-{self.row_unit()} moving "
+                      "average)")
+            plt.gcf().autofmt_xdate()
+
         plt.savefig(self.graph)
+        plt.close()
+
+        if watermark is not None:
+            STATE.set(self.name, "watermark", watermark)
 
         logger.info("Saved to %s", self.graph)
+
+    def output_version(self) -> Optional[str]:
+        return STATE.get(self.name, "watermark", default=None)
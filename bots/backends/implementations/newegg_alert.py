@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import sqlite3
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from bots.backends.implementations.newegg import NeweggBackend
+from bots.backends.implementations.newegg_schema import DELISTED
+from bots.backends.registry import register
+from bots.http_client import get_client
+
+logger = logging.getLogger(__name__)
+
+# The last known (time, in_stock, price) of a product.
+LastState = Tuple[int, int, float]
+
+Alert = Dict[str, Any]
+
+
+class AlertSink(ABC):
+    """Delivers a batch of alerts.
+
+    Args:
+        target: Where to deliver the alerts; its meaning depends on the sink
+    """
+
+    def __init__(self, target: str) -> None:
+        self.target = target
+
+    @abstractmethod
+    async def send(self, alerts: List[Alert]) -> None:
+        """Delivers the alerts, raising if they couldn't be delivered."""
+
+
+def _ndjson(alerts: List[Alert]) -> bytes:
+    return "".join(
+        json.dumps(alert, separators=(",", ":")) + "\n"
+        for alert in alerts).encode("utf-8")
+
+
+class FileSink(AlertSink):
+    """Appends the alerts to a file, one JSON object per line."""
+
+    async def send(self, alerts: List[Alert]) -> None:
+        path = Path(self.target).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(_ndjson(alerts))
+
+
+class WebhookSink(AlertSink):
+    """Posts the alerts to a URL, as `{"alerts": [...]}`."""
+
+    async def send(self, alerts: List[Alert]) -> None:
+        response = await get_client().post(
+            self.target,
+            json.dumps({"alerts": alerts}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        if not 200 <= response.status < 300:
+            raise RuntimeError(f"Webhook {self.target} returned status "
+                               f"{response.status}")
+
+
+class CommandSink(AlertSink):
+    """Runs a shell command with the alerts on stdin, one JSON per line."""
+
+    async def send(self, alerts: List[Alert]) -> None:
+        process = await asyncio.create_subprocess_shell(
+            self.target,
+            stdin=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        try:
+            await process.communicate(_ndjson(alerts))
+        except asyncio.CancelledError:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            raise
+        if process.returncode != 0:
+            raise RuntimeError(f"Alert command exited with code "
+                               f"{process.returncode}")
+
+
+SINKS: Dict[str, Type[AlertSink]] = {
+    "file": FileSink,
+    "webhook": WebhookSink,
+    "command": CommandSink,
+}
+
+
+@register("newegg-alert")
+class NeweggAlertBackend(NeweggBackend):
+    """Sends alerts when products come back in stock or drop in price.
+
+    This reads the table written by a `newegg-availability` bot, which this
+    bot should depend on. The last known stock and price of each product is
+    kept in `<table>_alert_index`, which is seeded from the latest row of
+    each product the first time the bot runs, without sending any alerts.
+    After that, each run only reads the rows newer than the last row it
+    consumed, using the time index, and updates the index from them, so the
+    cost of a run depends on the number of new rows rather than the size of
+    the table. The index is also kept in memory between runs of the daemon.
+
+    Rules:
+
+        restock: If `true` (the default), alert when a product goes from
+            out of stock or delisted to in stock; products which are in
+            stock the first time they are seen don't count
+        price_below: Alert when a product's price goes from at or above
+            this threshold to below it; either a number for every product,
+            or a JSON object mapping product IDs to thresholds
+
+    `products` optionally limits the alerts to a JSON list of product IDs.
+
+    Alerts are delivered to `sink`, which is one of:
+
+        file: Appends one JSON object per line to the file at `target`
+        webhook: Posts `{"alerts": [...]}` to the URL at `target`
+        command: Runs the shell command in `target`, with one JSON object
+            per line on stdin
+
+    The index and watermark are only saved after the alerts are delivered,
+    so if delivery fails, the same alerts are sent again on the next run.
+    """
+
+    def __init__(self, name: str, config: Dict[str, str]) -> None:
+        # Parses the products to alert on.
+        products = config.pop("products", None)
+        self.products: Optional[List[str]] = None if products is None else \
+            json.loads(products)
+
+        # Parses the alert rules.
+        self.restock = config.pop("restock", "true").lower() == "true"
+        price_below = json.loads(config.pop("price_below", "null"))
+        if price_below is None or isinstance(price_below, dict):
+            self.price_below: Optional[Dict[str, float]] = None if \
+                price_below is None else \
+                {k: float(v) for k, v in price_below.items()}
+            self.default_price_below: Optional[float] = None
+        else:
+            self.price_below = None
+            self.default_price_below = float(price_below)
+
+        # Parses where to send the alerts.
+        sink = config.pop("sink", "file")
+        if sink not in SINKS:
+            raise ValueError(f"Invalid sink: {sink}; expected one of "
+                             f"{', '.join(SINKS)}")
+        self.sink = SINKS[sink](config.pop("target"))
+
+        self._index: Optional[Dict[str, LastState]] = None
+        self._watermark: Optional[int] = None
+
+        super().__init__(name, config)
+
+    @property
+    def index_table(self) -> str:
+        return f"{self.table}_alert_index"
+
+    @property
+    def watermark_table(self) -> str:
+        return f"{self.table}_alert_watermarks"
+
+    def connect(self) -> sqlite3.Connection:
+        conn = super().connect()
+        with conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.index_table} (
+                    bot text NOT NULL,
+                    id text NOT NULL,
+                    time integer NOT NULL,
+                    in_stock integer NOT NULL,
+                    price real NOT NULL,
+                    PRIMARY KEY (bot, id)
+                ) WITHOUT ROWID
+            """)
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.watermark_table} (
+                    bot text NOT NULL PRIMARY KEY,
+                    time integer NOT NULL
+                ) WITHOUT ROWID
+            """)
+        return conn
+
+    def threshold(self, id_str: str) -> Optional[float]:
+        if self.price_below is not None:
+            return self.price_below.get(id_str)
+        return self.default_price_below
+
+    def load(self) -> Tuple[Dict[str, LastState], Optional[int]]:
+        """Loads the index and watermark, or seeds them from the table."""
+
+        if self._index is not None and self._watermark is not None:
+            return self._index, self._watermark
+
+        cur = self.conn.cursor()
+        cur.execute(f"SELECT time FROM {self.watermark_table} WHERE bot = ?",
+                    (self.name, ))
+        row = cur.fetchone()
+        if row is not None:
+            cur.execute(
+                f"""
+                SELECT id, time, in_stock, price FROM {self.index_table}
+                WHERE bot = ?
+                """, (self.name, ))
+            self._index = {id_str: tuple(state) for id_str, *state in cur}
+            self._watermark = row[0]
+            return self._index, self._watermark
+
+        cur.execute(f"""
+            SELECT t.id, t.time, t.in_stock, t.price
+            FROM {self.table} AS t
+            JOIN (
+                SELECT id, max(time) AS time
+                FROM {self.table}
+                GROUP BY id
+            ) AS latest
+            ON t.id = latest.id AND t.time = latest.time
+        """)
+        index = {id_str: tuple(state) for id_str, *state in cur}
+        watermark = max((state[0] for state in index.values()), default=None)
+        self.save(index, list(index), watermark)
+        logger.info("Seeded the index of %s with %d products", self.name,
+                    len(index))
+        return index, watermark
+
+    def save(
+        self,
+        index: Dict[str, LastState],
+        changed: List[str],
+        watermark: Optional[int],
+    ) -> None:
+        """Saves the changed index entries and the watermark together."""
+
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {self.index_table} "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(self.name, id_str, *index[id_str]) for id_str in changed])
+            if watermark is not None:
+                self.conn.execute(
+                    f"INSERT OR REPLACE INTO {self.watermark_table} "
+                    "VALUES (?, ?)", (self.name, watermark))
+        self._index, self._watermark = index, watermark
+
+    def check(
+        self,
+        id_str: str,
+        last: Optional[LastState],
+        time: int,
+        in_stock: int,
+        price: float,
+    ) -> List[Alert]:
+        """Evaluates the rules for a product's new row."""
+
+        if self.products is not None and id_str not in self.products:
+            return []
+
+        alerts: List[Alert] = []
+        # A product without a previous row is new, rather than restocked.
+        restocked = last is not None and last[1] != 1 and in_stock == 1
+        if self.restock and restocked:
+            alerts.append({"kind": "restock", "id": id_str, "time": time,
+                           "price": price})
+
+        threshold = self.threshold(id_str)
+        was_below = last is not None and last[1] != DELISTED and \
+            threshold is not None and last[2] < threshold
+        if threshold is not None and in_stock != DELISTED and \
+                price < threshold and not was_below:
+            alerts.append({
+                "kind": "price",
+                "id": id_str,
+                "time": time,
+                "price": price,
+                "previous_price": None if last is None else last[2],
+                "threshold": threshold,
+            })
+        return alerts
+
+    async def run(self) -> None:
+        index, watermark = self.load()
+        if watermark is None:
+            logger.info("No rows for %s yet", self.name)
+            return
+
+        # The index is updated in a copy, so that it is unchanged if the
+        # alerts can't be delivered.
+        index = dict(index)
+        changed: Dict[str, None] = {}
+        alerts: List[Alert] = []
+        cur = self.conn.cursor()
+        cur.execute(
+            f"""
+            SELECT time, id, in_stock, price FROM {self.table}
+            WHERE time > ?
+            ORDER BY time, id
+            """, (watermark, ))
+        num_rows = 0
+        for time, id_str, in_stock, price in cur:
+            num_rows += 1
+            alerts += self.check(id_str, index.get(id_str), time, in_stock,
+                                 price)
+            index[id_str] = (time, in_stock, price)
+            changed[id_str] = None
+            watermark = time
+
+        if alerts:
+            ids = sorted({alert["id"] for alert in alerts})
+            cur.execute(
+                f"""
+                SELECT id, name FROM {self.products_table}
+                WHERE id IN ({', '.join('?' * len(ids))})
+                """, ids)
+            names = dict(cur.fetchall())
+            for alert in alerts:
+                alert["bot"] = self.name
+                alert["name"] = names.get(alert["id"], "")
+            await self.sink.send(alerts)
+
+        self.save(index, list(changed), watermark)
+        self.rows_written = len(alerts)
+        logger.info("Read %d new rows and sent %d alerts", num_rows,
+                    len(alerts))
+
+    def output_version(self) -> Optional[str]:
+        if self._watermark is None:
+            return None
+        return str(self._watermark)
+
+    def props(self) -> Dict[str, Any]:
+        props = {
+            **super().props(),
+            "sink": type(self.sink).__name__,
+            "target": self.sink.target,
+        }
+        if self.products is not None:
+            props["products"] = self.products
+        return props
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+import csv
+import io
+import json
+import logging
+import sqlite3
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import flask
+from bots.backends.implementations import newegg_schema as schema
+from bots.backends.interfaces.flask_interface import FlaskBackend
+from bots.backends.registry import register
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("time", "id", "name", "in_stock", "price")
+
+Row = Tuple[int, str, str, int, float]
+
+
+def _to_csv(rows: List[Row], header: bool) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(COLUMNS)
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def _to_ndjson(rows: List[Row], header: bool) -> str:
+    return "".join(
+        json.dumps(dict(zip(COLUMNS, row)), separators=(",", ":")) + "\n"
+        for row in rows)
+
+
+FORMATS = {
+    "csv": (_to_csv, "text/csv"),
+    "ndjson": (_to_ndjson, "application/x-ndjson"),
+}
+
+
+def _int_arg(args: Any, key: str) -> Optional[int]:
+    if key not in args:
+        return None
+    try:
+        return int(args[key])
+    except ValueError:
+        raise ValueError(f"`{key}` should be an integer, got {args[key]!r}")
+
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@register("newegg-export")
+class NeweggExportBackend(FlaskBackend):
+    """Streams rows of a Newegg table as CSV or NDJSON.
+
+    Query parameters:
+
+        format: `csv` (the default) or `ndjson`
+        since, until: Only rows with `since <= time < until`, as epoch
+            seconds
+        id: Only these product IDs; can be repeated
+        limit: The maximum number of rows to return
+        after: Only rows after this one, as `<time>:<id>` of the last row
+            of the previous page
+
+    Without `id`, rows are ordered by time, then ID, using the time index;
+    with it, they are ordered by ID, then time, using the primary key, and
+    `after` is compared in that order. Rows are read from the database in
+    chunks of `chunk_size` as the response is sent, so memory use doesn't
+    depend on how many rows are exported. Responses are gzipped on the fly
+    for clients which accept it.
+
+    In delta storage, rows are change points, and `in_stock` is -1 for rows
+    marking that a product was delisted.
+    """
+
+    def __init__(self, name: str, config: Dict[str, str]) -> None:
+        # Parses the DB path.
+        self.db = Path(config.pop("db"))
+
+        # Parses the table name.
+        self.table = config.pop("table")
+
+        # Parses the number of rows to read at once.
+        self.chunk_size = int(config.pop("chunk_size", "1000"))
+
+        super().__init__(name, config)
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{self.db}?mode=ro", uri=True,
+                               check_same_thread=False)
+
+    def query(
+        self,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        ids: Optional[List[str]] = None,
+        after: Optional[Tuple[int, str]] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[str, List[Any]]:
+        """Builds the export query, so that it can be answered by an index.
+
+        Returns:
+            The query and its parameters
+        """
+
+        where: List[str] = []
+        params: List[Any] = []
+        if since is not None:
+            where.append("t.time >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("t.time < ?")
+            params.append(until)
+        if ids:
+            where.append(f"t.id IN ({', '.join('?' * len(ids))})")
+            params.extend(ids)
+            if after is not None:
+                where.append("(t.id, t.time) > (?, ?)")
+                params.extend([after[1], after[0]])
+            order = "t.id, t.time"
+        else:
+            if after is not None:
+                where.append("(t.time, t.id) > (?, ?)")
+                params.extend(after)
+            order = "t.time, t.id"
+
+        query = f"""
+            SELECT t.time, t.id, coalesce(p.name, ''), t.in_stock, t.price
+            FROM {self.table} AS t
+            LEFT JOIN {schema.products_table(self.table)} AS p ON p.id = t.id
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY {order}
+        """
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return query, params
+
+    def iter_rows(self, query: str, params: List[Any]) -> Iterator[List[Row]]:
+        """Yields chunks of rows, holding the connection only while reading."""
+
+        conn = self.connect()
+        try:
+            cur = conn.execute(query, params)
+            while True:
+                rows = cur.fetchmany(self.chunk_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            conn.close()
+
+    def run_flask(self) -> Union[str, flask.Response]:
+        args = flask.request.args
+        fmt = args.get("format", "csv")
+        if fmt not in FORMATS:
+            return flask.abort(400, f"Unknown format: {fmt}")
+        encode, mimetype = FORMATS[fmt]
+
+        try:
+            since = _int_arg(args, "since")
+            until = _int_arg(args, "until")
+            limit = _int_arg(args, "limit")
+            after: Optional[Tuple[int, str]] = None
+            if "after" in args:
+                after_time, sep, after_id = args["after"].partition(":")
+                if not sep or not after_time.isdigit():
+                    raise ValueError("`after` should be <time>:<id>")
+                after = (int(after_time), after_id)
+        except ValueError as exp:
+            return flask.abort(400, str(exp))
+        if limit is not None and limit < 0:
+            return flask.abort(400, "`limit` can't be negative")
+        if not self.db.exists():
+            return flask.abort(404)
+
+        ids = args.getlist("id") or None
+        query, params = self.query(since, until, ids, after, limit)
+
+        def generate() -> Iterator[bytes]:
+            header = True
+            for rows in self.iter_rows(query, params):
+                yield encode(rows, header).encode("utf-8")
+                header = False
+            if header and fmt == "csv":
+                yield encode([], header).encode("utf-8")
+
+        chunks = generate()
+        gzipped = bool(flask.request.accept_encodings["gzip"])
+        if gzipped:
+            chunks = _gzip(chunks)
+        response = flask.Response(chunks, mimetype=mimetype)
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        response.cache_control.max_age = self.cache_max_age
+        return response
+
+    def props(self) -> Dict[str, Any]:
+        return {**super().props(), "db": self.db, "table": self.table}
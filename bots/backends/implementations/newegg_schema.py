@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+"""Defines the SQLite schema shared by the Newegg backends.
+
+Versions:
+
+    1: One `time text, id, name, in_stock, price` row per product per run,
+       with a unique `(time, id)` index.
+    2: Integer epoch times, product names moved to a `<table>_products`
+       table, and the rows keyed by `(id, time)` in a `WITHOUT ROWID` table
+       with a secondary index on `time`.
+    3: Per-run, hourly and daily rollups of the listed products, which are
+       updated as each run is inserted.
+
+Older databases are converted in place with:
+
+    python -m bots.endpoints.migrate
+"""
+
+import contextlib
+import logging
+import sqlite3
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from bots.utils import Time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 3
+
+# (time, id, name, in_stock, price)
+Item = Tuple[int, str, str, int, float]
+
+# In delta mode, marks a product which is no longer listed.
+DELISTED = -1
+
+# Maps each rollup resolution to its bucket size in seconds; per-run
+# rollups have one bucket per run.
+ROLLUPS: Dict[str, Optional[int]] = {
+    "run": None,
+    "hourly": 60 * 60,
+    "daily": 60 * 60 * 24,
+}
+
+SCHEMA_TABLE = "bots_schema"
+
+
+class SchemaVersionError(Exception):
+    pass
+
+
+def products_table(table: str) -> str:
+    return f"{table}_products"
+
+
+def runs_table(table: str) -> str:
+    return f"{table}_runs"
+
+
+def exception_table(table: str) -> str:
+    return f"{table}_exceptions"
+
+
+def rollup_table(table: str, resolution: str) -> str:
+    return f"{table}_rollup_{resolution}"
+
+
+def table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    cur = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (table,),
+    )
+    return cur.fetchone() is not None
+
+
+def get_version(conn: sqlite3.Connection, table: str) -> Optional[int]:
+    """Gets the schema version of a table, or None if it doesn't exist."""
+
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_TABLE} (
+            name text NOT NULL PRIMARY KEY,
+            version integer NOT NULL
+        ) WITHOUT ROWID
+    """)
+    row = conn.execute(f"SELECT version FROM {SCHEMA_TABLE} WHERE name = ?",
+                       (table,)).fetchone()
+    if row is not None:
+        return row[0]
+    return 1 if table_exists(conn, table) else None
+
+
+def set_version(conn: sqlite3.Connection, table: str, version: int) -> None:
+    conn.execute(f"INSERT OR REPLACE INTO {SCHEMA_TABLE} VALUES (?, ?)",
+                 (table, version))
+
+
+def _create_data_tables(conn: sqlite3.Connection, table: str) -> None:
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            time integer NOT NULL,
+            id text NOT NULL,
+            in_stock integer NOT NULL,
+            price real NOT NULL,
+            PRIMARY KEY (id, time)
+        ) WITHOUT ROWID
+    """)
+
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {runs_table(table)} (
+            time integer NOT NULL PRIMARY KEY,
+            items integer NOT NULL,
+            content_hash text NOT NULL,
+            delta integer NOT NULL
+        )
+    """)
+
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {exception_table(table)} (
+            time integer NOT NULL,
+            exception text NOT NULL
+        )
+    """)
+
+
+def _create_products_table(conn: sqlite3.Connection, table: str) -> None:
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {products_table(table)} (
+            id text NOT NULL PRIMARY KEY,
+            name text NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+def _create_indices(conn: sqlite3.Connection, table: str) -> None:
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS {table}_time_index
+        ON {table}(time)
+    """)
+
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS {exception_table(table)}_index
+        ON {exception_table(table)}(time)
+    """)
+
+
+def _create_rollup_tables(conn: sqlite3.Connection, table: str) -> None:
+    for resolution in ROLLUPS:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {rollup_table(table, resolution)} (
+                time integer NOT NULL PRIMARY KEY,
+                runs integer NOT NULL,
+                items integer NOT NULL,
+                in_stock integer NOT NULL,
+                price real NOT NULL
+            )
+        """)
+
+
+def update_rollups(
+    conn: sqlite3.Connection,
+    table: str,
+    time: int,
+    items: List[Item],
+) -> None:
+    """Adds one run's listed products to the rollups.
+
+    Each rollup row holds the number of runs, the total number of listed
+    items and the sums of `in_stock` and `price` over them, so averages over
+    any bucket are `in_stock / items` and `price / items`. This should be
+    called inside the transaction which inserts the run.
+    """
+
+    in_stock = sum(item[3] for item in items)
+    price = sum(item[4] for item in items)
+    for resolution, bucket_size in ROLLUPS.items():
+        bucket = time if bucket_size is None else time - time % bucket_size
+        conn.execute(f"""
+            INSERT INTO {rollup_table(table, resolution)}
+            VALUES (?, 1, ?, ?, ?)
+            ON CONFLICT (time) DO UPDATE SET
+                runs = runs + 1,
+                items = items + excluded.items,
+                in_stock = in_stock + excluded.in_stock,
+                price = price + excluded.price
+        """, (bucket, len(items), in_stock, price))
+
+
+def iter_snapshots(
+    conn: sqlite3.Connection,
+    table: str,
+    since: Optional[int] = None,
+) -> Iterator[Tuple[int, List[Item]]]:
+    """Iterates over the listed products at each run.
+
+    Runs in delta mode only store the products which changed, so the
+    snapshots are rebuilt by carrying each product's last row forward.
+    Times in the table without a matching run come from before runs were
+    recorded, and are treated as full snapshots.
+
+    Args:
+        conn: The database connection
+        table: The base table name
+        since: If set, only yield runs after this time; the rows before it
+            are still read, to rebuild the first snapshot
+
+    Yields:
+        The time of each run, and the products listed in it
+    """
+
+    run_cur = conn.cursor()
+    run_cur.execute(f"""
+        SELECT time, delta FROM {runs_table(table)}
+        UNION
+        SELECT DISTINCT time, 0 FROM {table}
+        WHERE time NOT IN (SELECT time FROM {runs_table(table)})
+        ORDER BY time
+    """)
+
+    row_cur = conn.cursor()
+    row_cur.execute(f"""
+        SELECT t.time, t.id, p.name, t.in_stock, t.price
+        FROM {table} AS t
+        JOIN {products_table(table)} AS p ON t.id = p.id
+        ORDER BY t.time
+    """)
+    row: Optional[Item] = row_cur.fetchone()
+
+    products: Dict[str, Item] = {}
+    for time, delta in run_cur:
+        if not delta:
+            products = {}
+        while row is not None and row[0] <= time:
+            if row[3] == DELISTED:
+                products.pop(row[1], None)
+            else:
+                products[row[1]] = row
+            row = row_cur.fetchone()
+        if since is None or time > since:
+            yield time, list(products.values())
+
+
+def create_tables(conn: sqlite3.Connection, table: str) -> None:
+    """Creates the tables, or checks that they are up to date.
+
+    Raises:
+        SchemaVersionError: If the tables use an older schema
+    """
+
+    version = get_version(conn, table)
+    if version is not None and version < SCHEMA_VERSION:
+        raise SchemaVersionError(f"Table '{table}' uses schema version "
+                                 f"{version}; run `python -m bots.endpoints."
+                                 "migrate` to upgrade it")
+    if version == SCHEMA_VERSION:
+        return
+
+    with conn:
+        _create_data_tables(conn, table)
+        _create_products_table(conn, table)
+        _create_indices(conn, table)
+        _create_rollup_tables(conn, table)
+        set_version(conn, table, SCHEMA_VERSION)
+
+
+@contextlib.contextmanager
+def _ddl_transaction(conn: sqlite3.Connection) -> Iterator[None]:
+    """Runs schema changes in one transaction, rolling back on errors.
+
+    `sqlite3` doesn't open a transaction before DDL statements, so `with
+    conn:` alone would leave a half-done table swap behind if the process
+    died part way through it.
+    """
+
+    conn.commit()
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.isolation_level = isolation_level
+
+
+def _migrate_rows(
+    conn: sqlite3.Connection,
+    src: str,
+    dst: str,
+    columns: str,
+    write: Callable[[List[Tuple[Any, ...]]], None],
+    batch_size: int,
+) -> None:
+    """Copies rows between tables in batches, resuming from the last batch.
+
+    The first column is converted from a time string to an epoch. Progress
+    is tracked by rowid in the schema table, under `dst`, so an interrupted
+    migration picks up where it left off.
+    """
+
+    key = f"{dst}:rowid"
+    row = conn.execute(f"SELECT version FROM {SCHEMA_TABLE} WHERE name = ?",
+                       (key,)).fetchone()
+    last_rowid = -1 if row is None else row[0]
+
+    while True:
+        rows = conn.execute(
+            f"SELECT rowid, {columns} FROM {src} WHERE rowid > ? "
+            "ORDER BY rowid LIMIT ?",
+            (last_rowid, batch_size),
+        ).fetchall()
+        if not rows:
+            break
+        with conn:
+            write([(Time.epoch(Time.parse(r[1])), *r[2:]) for r in rows])
+            last_rowid = rows[-1][0]
+            set_version(conn, key, last_rowid)
+        logger.info("Copied %d rows from %s (up to rowid %d)", len(rows),
+                    src, last_rowid)
+
+    with conn:
+        conn.execute(f"DELETE FROM {SCHEMA_TABLE} WHERE name = ?", (key,))
+
+
+def _migrate_v1(
+    conn: sqlite3.Connection,
+    table: str,
+    batch_size: int,
+) -> None:
+    """Copies the rows into new tables, then swaps out the old tables."""
+
+    new = f"{table}_v2"
+    with conn:
+        _create_data_tables(conn, new)
+        _create_products_table(conn, table)
+
+    def write_items(rows: List[Tuple[Any, ...]]) -> None:
+        # Rows are copied in insertion order, so later names win.
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {products_table(table)} VALUES (?, ?)",
+            [(r[1], r[2]) for r in rows],
+        )
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {new} VALUES (?, ?, ?, ?)",
+            [(r[0], r[1], r[3], r[4]) for r in rows],
+        )
+
+    def write_runs(rows: List[Tuple[Any, ...]]) -> None:
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {runs_table(new)} VALUES (?, ?, ?, ?)",
+            rows,
+        )
+
+    def write_exceptions(rows: List[Tuple[Any, ...]]) -> None:
+        conn.executemany(
+            f"INSERT INTO {exception_table(new)} VALUES (?, ?)",
+            rows,
+        )
+
+    _migrate_rows(conn, table, new, "time, id, name, in_stock, price",
+                  write_items, batch_size)
+    if table_exists(conn, runs_table(table)):
+        _migrate_rows(conn, runs_table(table), runs_table(new),
+                      "time, items, content_hash, delta", write_runs,
+                      batch_size)
+    if table_exists(conn, exception_table(table)):
+        _migrate_rows(conn, exception_table(table), exception_table(new),
+                      "time, exception", write_exceptions, batch_size)
+
+    # Swaps in the new tables.
+    with _ddl_transaction(conn):
+        for old_table, new_table in [
+            (table, new),
+            (runs_table(table), runs_table(new)),
+            (exception_table(table), exception_table(new)),
+        ]:
+            conn.execute(f"DROP TABLE IF EXISTS {old_table}")
+            conn.execute(f"ALTER TABLE {new_table} RENAME TO {old_table}")
+        _create_indices(conn, table)
+        set_version(conn, table, 2)
+
+
+def _migrate_v2(
+    conn: sqlite3.Connection,
+    table: str,
+    batch_size: int,
+) -> None:
+    """Builds the rollups from the existing runs."""
+
+    with conn:
+        for resolution in ROLLUPS:
+            conn.execute(f"DROP TABLE IF EXISTS "
+                         f"{rollup_table(table, resolution)}")
+        _create_rollup_tables(conn, table)
+
+    num_runs = 0
+    with conn:
+        for time, items in iter_snapshots(conn, table):
+            update_rollups(conn, table, time, items)
+            num_runs += 1
+            if num_runs % batch_size == 0:
+                conn.commit()
+                logger.info("Rolled up %d runs", num_runs)
+        set_version(conn, table, 3)
+
+
+MIGRATIONS = {
+    1: _migrate_v1,
+    2: _migrate_v2,
+}
+
+
+def migrate(
+    conn: sqlite3.Connection,
+    table: str,
+    batch_size: int = 10000,
+) -> bool:
+    """Migrates the tables to the current schema version.
+
+    Rows are copied in batches, each in its own transaction, so the
+    database stays usable by readers while a large table is converted.
+
+    Args:
+        conn: The database connection
+        table: The base table name
+        batch_size: The number of rows (or runs) per transaction
+
+    Returns:
+        If anything was migrated
+    """
+
+    version = get_version(conn, table)
+    if version is None or version == SCHEMA_VERSION:
+        return False
+
+    while version < SCHEMA_VERSION:
+        if version not in MIGRATIONS:
+            raise SchemaVersionError(f"Unknown schema version: {version}")
+        logger.info("Migrating %s from version %d", table, version)
+        MIGRATIONS[version](conn, table, batch_size)
+        version += 1
+
+    return True
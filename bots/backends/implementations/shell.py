@@ -1,10 +1,56 @@
 #!/usr/bin/env python
 
-import subprocess
-from typing import Dict
+import asyncio
+import logging
+import logging.handlers
+import os
+import re
+import signal
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
 
 from bots.backends.interfaces.cron_interface import CronBackend
 from bots.backends.registry import register
+from bots.state import STATE
+
+logger = logging.getLogger(__name__)
+
+# Longest line of output that is read at once.
+MAX_LINE_LENGTH = 1 << 20
+
+SIZE_RE = re.compile(r"^\s*(\d+)\s*([kmgt]?)b?\s*$", re.IGNORECASE)
+SIZE_UNITS = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+
+def parse_size(size: str) -> int:
+    """Parses a size like "512M" to a number of bytes."""
+
+    match = SIZE_RE.match(size)
+    if match is None:
+        raise ValueError(f"Invalid size: {size}")
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).lower()]
+
+
+def _set_limits(
+    cpu_limit: Optional[int],
+    memory_limit: Optional[int],
+) -> Optional[Callable[[], None]]:
+    # preexec_fn makes subprocess fall back from posix_spawn and isn't safe
+    # with threads, so it's only passed when there are limits to set.
+    if cpu_limit is None and memory_limit is None:
+        return None
+
+    def set_limits() -> None:
+        import resource
+
+        if cpu_limit is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
+        if memory_limit is not None:
+            resource.setrlimit(resource.RLIMIT_AS,
+                               (memory_limit, memory_limit))
+
+    return set_limits
 
 
 @register("shell")
@@ -14,14 +60,152 @@ class ShellBackend(CronBackend):
     This is admittedly a bit convoluted, since this will probably be run
     from cron in the first place, but adding it as a backend makes sense
     because it allows us to depend on other existing bot jobs.
+
+    The command runs in its own process group, without blocking the other
+    bots. Its stdout and stderr are written line by line to a rotating log
+    file in `log_dir`, and its exit code and duration are saved to the
+    state. A non-zero exit code fails the run. If the run times out, the
+    whole process group is sent SIGTERM, then SIGKILL after `kill_grace`
+    seconds. `cpu_limit` (seconds) and `memory_limit` (bytes, or a size
+    like "512M") set per-command resource limits.
+
+    If the command writes a file, setting `output` to its path publishes the
+    file's modification time and size as the bot's output version, so that
+    dependents which list it in `inputs` can skip unchanged output.
     """
 
     def __init__(self, name: str, config: Dict[str, str]) -> None:
         # Gets the shell command to run.
         self.command = config.pop("command")
 
+        # Parses where to write the command output.
+        log_dir = config.pop("log_dir", None)
+        if log_dir is None:
+            self.log_dir = Path("~/.config").expanduser() / "bots" / "logs"
+        else:
+            self.log_dir = Path(log_dir).expanduser()
+        self.log_max_bytes = parse_size(config.pop("log_max_bytes", "1M"))
+        self.log_backups = int(config.pop("log_backups", "3"))
+
+        # Parses the resource limits.
+        cpu_limit = config.pop("cpu_limit", None)
+        self.cpu_limit = None if cpu_limit is None else int(cpu_limit)
+        memory_limit = config.pop("memory_limit", None)
+        self.memory_limit = None if memory_limit is None else \
+            parse_size(memory_limit)
+
+        # Parses the file the command produces, if any.
+        output_path = config.pop("output", None)
+        self.output_path = None if output_path is None else \
+            Path(output_path).expanduser()
+
+        # Parses how long to wait after SIGTERM before sending SIGKILL.
+        self.kill_grace = float(config.pop("kill_grace", "5"))
+
+        self._output: Optional[logging.Logger] = None
+
         super().__init__(name, config)
 
+    @property
+    def log_path(self) -> Path:
+        return self.log_dir / f"{self.name}.log"
+
+    @property
+    def output(self) -> logging.Logger:
+        if self._output is None:
+            self.log_dir.mkdir(parents=True, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                self.log_path,
+                maxBytes=self.log_max_bytes,
+                backupCount=self.log_backups,
+            )
+            handler.setFormatter(
+                logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+            output = logging.getLogger(f"{__name__}.{self.name}")
+            output.setLevel(logging.INFO)
+            output.propagate = False
+            output.addHandler(handler)
+            self._output = output
+        return self._output
+
+    def close(self) -> None:
+        if self._output is not None:
+            for handler in list(self._output.handlers):
+                self._output.removeHandler(handler)
+                handler.close()
+            self._output = None
+
+    async def _stream(self, stream: asyncio.StreamReader, level: int) -> None:
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # The line was longer than the limit; logs what was read.
+                line = await stream.read(MAX_LINE_LENGTH)
+            if not line:
+                return
+            self.output.log(level, "%s",
+                            line.decode(errors="replace").rstrip("\n"))
+
+    async def _kill(self, process: asyncio.subprocess.Process) -> None:
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), self.kill_grace)
+            except asyncio.TimeoutError:
+                logger.warning("%s didn't exit after SIGTERM; killing it",
+                               self.name)
+                os.killpg(process.pid, signal.SIGKILL)
+                await process.wait()
+        except ProcessLookupError:
+            pass
+
     async def run(self) -> None:
-        process = subprocess.Popen(self.command, shell=True)
-        process.communicate()
+        self.output.info("Running: %s", self.command)
+        start = time.monotonic()
+        process = await asyncio.create_subprocess_shell(
+            self.command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+            preexec_fn=_set_limits(self.cpu_limit, self.memory_limit),
+            limit=MAX_LINE_LENGTH,
+        )
+        assert process.stdout is not None and process.stderr is not None
+
+        try:
+            await asyncio.gather(
+                self._stream(process.stdout, logging.INFO),
+                self._stream(process.stderr, logging.WARNING),
+            )
+            exit_code = await process.wait()
+        except asyncio.CancelledError:
+            self.output.error("Cancelled; killing process group %d",
+                              process.pid)
+            await asyncio.shield(self._kill(process))
+            raise
+        finally:
+            duration = time.monotonic() - start
+            STATE.set(self.name, "exit_code", str(process.returncode))
+            STATE.set(self.name, "command_duration", f"{duration:.3f}")
+
+        self.output.info("Exited with code %d after %.3f seconds", exit_code,
+                         duration)
+        if exit_code != 0:
+            raise RuntimeError(f"Command exited with code {exit_code}; see "
+                               f"{self.log_path}")
+
+    def output_version(self) -> Optional[str]:
+        if self.output_path is None or not self.output_path.exists():
+            return None
+        stat = self.output_path.stat()
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    def props(self) -> Dict[str, Any]:
+        props = {**super().props(), "command": self.command}
+        if self.cpu_limit is not None:
+            props["cpu_limit"] = self.cpu_limit
+        if self.memory_limit is not None:
+            props["memory_limit"] = self.memory_limit
+        return props
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
 import logging
-from typing import Dict, Union
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
 
 import flask
 from bots.backends.interfaces.flask_interface import FlaskBackend
@@ -12,13 +15,50 @@ logger = logging.getLogger(__name__)
 
 @register("simple-website")
 class SimpleWebsiteBackend(FlaskBackend):
-    """Provides a simple website backend."""
+    """Provides a simple website backend.
+
+    The file is read when it is first served, and re-read whenever its
+    modification time or size changes.
+    """
 
     def __init__(self, name: str, config: Dict[str, str]) -> None:
-        with open(config.pop("path"), "r") as f:
-            self.site_contents: str = f.read()
+        self.path = Path(config.pop("path"))
+        self.lock = threading.Lock()
+        self._stat_key: Optional[Tuple[int, int]] = None
+        self.site_contents: str = ""
 
         super().__init__(name, config)
 
+    def reload(self) -> Tuple[int, int]:
+        """Re-reads the file if it changed, returning its (mtime, size)."""
+
+        stat = self.path.stat()
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        if stat_key != self._stat_key:
+            with self.lock:
+                if stat_key != self._stat_key:
+                    with open(self.path, "r") as f:
+                        self.site_contents = f.read()
+                    self._stat_key = stat_key
+                    logger.info("Loaded %s", self.path)
+        return stat_key
+
+    def close(self) -> None:
+        with self.lock:
+            self.site_contents = ""
+            self._stat_key = None
+
     def run_flask(self) -> Union[str, flask.Response]:
+        self.reload()
         return self.site_contents
+
+    def etag(self) -> Optional[str]:
+        mtime_ns, size = self.reload()
+        return f"{mtime_ns:x}-{size:x}"
+
+    def last_modified(self) -> Optional[datetime]:
+        mtime_ns, _ = self.reload()
+        return datetime.fromtimestamp(mtime_ns / 1e9, timezone.utc)
+
+    def props(self) -> Dict[str, Any]:
+        return {**super().props(), "path": self.path}
@@ -1,14 +1,22 @@
 #!/usr/bin/env python
 
 import enum
+import json
+import logging
+import os
+import socket
+import zlib
 from abc import ABC
 from datetime import datetime, timedelta
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple, Union
 
 from bots.backends.base import BaseBackend
+from bots.schedule import CronExpression
 from bots.state import STATE
 from bots.utils import Time
 
+logger = logging.getLogger(__name__)
+
 
 class CronMode(enum.Enum):
     never = "never"
@@ -33,35 +41,212 @@ class CronMode(enum.Enum):
             return timedelta(days=365)
         raise NotImplementedError(f"Invalid time mode: {self}")
 
+    def next_after(self, t: datetime) -> Optional[datetime]:
+        """Gets the next interval boundary after `t`.
+
+        Boundaries are aligned to multiples of the interval since the epoch,
+        so that schedules don't drift with how long each run took.
+        """
+
+        min_delta = self.timedelta()
+        if min_delta is None:
+            return None
+        if not min_delta:
+            return t
+        epoch = datetime(1970, 1, 1)
+        return epoch + ((t - epoch) // min_delta + 1) * min_delta
+
+
+class CatchUp(enum.Enum):
+    """What to do about ticks which were missed while a bot wasn't run."""
+
+    skip = "skip"
+    coalesce = "coalesce"
+    replay = "replay"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
 
 class CronBackend(BaseBackend, ABC):
-    """Provides a Cron-specific backend interface."""
+    """Provides a Cron-specific backend interface.
+
+    The `cron` key is either one of the `CronMode` intervals, which run the
+    bot on the next interval boundary after it last ran, or a five-field
+    cron expression like `*/5 9-17 * * 1-5`. The optional `jitter` key is a
+    number of seconds; each bot is delayed by a fixed offset in that window,
+    derived from its name, so that bots with the same schedule don't all
+    fire at once.
+
+    Only one copy of a bot runs at a time: claiming a run takes a lock in the
+    state, which records the host, process and start time of the run, and is
+    released by `finish_run`. A lock is stale, and taken over, if its process
+    is gone, or it is older than `stale_after` seconds (default a day). When
+    nodes are coordinated, the caller holds the bot's lease and passes its
+    node name, which is recorded in the lock; a lock taken by another node
+    is then stale straight away, since that node's lease must have expired.
+
+    The `catchup` key says what to do when the bot is late by more than one
+    tick, for example because the previous run overran or the host was
+    down. `coalesce` (the default) runs once; `skip` drops the missed ticks
+    and waits for the next one; `replay` runs once for every missed tick,
+    oldest first.
+    """
+
+    interface = "cron"
 
     def __init__(self, name: str, config: Dict[str, str]) -> None:
         """Builds the backend using its associated config."""
 
-        self.run_mode = CronMode(config.pop("cron", "none"))
+        cron = config.pop("cron", "never")
+        self.run_mode: Union[CronMode, CronExpression]
+        if cron in CronMode.__members__:
+            self.run_mode = CronMode(cron)
+        else:
+            self.run_mode = CronExpression(cron)
+
+        # Spreads runs over the jitter window, deterministically per bot.
+        jitter = float(config.pop("jitter", "0"))
+        fraction = zlib.crc32(name.encode("utf-8")) / 2**32
+        self.offset = timedelta(seconds=jitter * fraction)
+
+        # Parses the missed tick policy.
+        self.catchup = CatchUp(config.pop("catchup", "coalesce"))
+
+        # Parses when a run lock is considered abandoned.
+        self.stale_after = float(config.pop("stale_after", "86400"))
+        self._lock_token: Optional[str] = None
+
+        # Caches the next run time, keyed by the last run time.
+        self._next_run_key: Optional[Tuple[Optional[str]]] = None
+        self._next_run: Optional[datetime] = None
 
         super().__init__(name, config)
 
-    def should_run(self) -> bool:
+    def _get_next_run(self, last_run_str: Optional[str]) -> Optional[datetime]:
+        if self._next_run_key == (last_run_str,):
+            return self._next_run
+
+        if self.run_mode == CronMode.never:
+            next_run = None
+        elif last_run_str is None:
+            # Bots which have never run are due straight away.
+            next_run = datetime.min
+        else:
+            last_run = Time.parse(last_run_str) - self.offset
+            next_run = self.run_mode.next_after(last_run)
+            if next_run is not None:
+                next_run += self.offset
+
+        self._next_run_key = (last_run_str,)
+        self._next_run = next_run
+        return next_run
+
+    def next_run(self) -> Optional[datetime]:
+        """Gets the next time this backend is due, or None if it never is."""
+
+        last_run_str = STATE.get(self.name, "last_run", default=None)
+        return self._get_next_run(last_run_str)
+
+    def _is_stale(self, token: str, now: datetime,
+                  node: Optional[str]) -> bool:
+        # Locks which can't be parsed are treated as stale.
+        try:
+            lock = json.loads(token)
+            started = Time.parse(lock["start"])
+            pid = int(lock["pid"])
+        except (ValueError, KeyError, TypeError):
+            return True
+        if node is not None and lock.get("node") != node:
+            return True
+        if lock.get("host") == socket.gethostname() and not _pid_alive(pid):
+            return True
+        return (now - started).total_seconds() > self.stale_after
+
+    def _acquire(self, now: datetime, node: Optional[str]) -> bool:
+        token = json.dumps({
+            "host": socket.gethostname(),
+            "node": node,
+            "pid": os.getpid(),
+            "start": Time.get(now),
+        })
+        held = STATE.get(self.name, "running", default=None)
+        if held is not None:
+            if not self._is_stale(held, now, node):
+                logger.info("%s is still running (%s); skipping this tick",
+                            self.name, held)
+                return False
+            logger.warning("Taking over stale run lock of %s: %s", self.name,
+                           held)
+        if not STATE.compare_and_set(self.name, "running", held, token):
+            return False
+        self._lock_token = token
+        return True
+
+    def finish_run(self) -> None:
+        """Releases the run lock taken by `should_run`."""
+
+        if self._lock_token is not None:
+            STATE.compare_and_set(self.name, "running", self._lock_token, None)
+            self._lock_token = None
+
+    def is_running(self) -> bool:
+        return STATE.get(self.name, "running", default=None) is not None
+
+    def should_run(self, node: Optional[str] = None) -> bool:
+        """Checks if the bot is due, and claims the run if it is.
+
+        A claimed run holds the bot's run lock, which the caller must
+        release with `finish_run` once the run is over.
+
+        Args:
+            node: If set, the caller holds the bot's lease as this node, so
+                run locks left by other nodes are taken over
+
+        Returns:
+            If the run was claimed
+        """
+
         curr_time = datetime.now()
-        curr_time_str = Time.get(curr_time)
         last_run_str = STATE.get(self.name, "last_run", default=None)
-        if last_run_str is None:
-            should_run = True
-        else:
-            last_run = Time.parse(last_run_str)
-            delta = curr_time - last_run
-            min_delta = self.run_mode.timedelta()
-            if min_delta is None:
-                should_run = False
-            else:
-                should_run = delta >= min_delta
-
-        if should_run:
-            STATE.set(self.name, "last_run", curr_time_str)
-        return should_run
+        next_run = self._get_next_run(last_run_str)
+        if next_run is None or curr_time < next_run:
+            return False
+
+        # Decides what to record as the last run, for ticks that were missed.
+        run_time = curr_time
+        if last_run_str is not None:
+            tick = next_run - self.offset
+            following = self.run_mode.next_after(tick)
+            missed = following is not None and following > tick and \
+                following + self.offset <= curr_time
+            if missed and self.catchup == CatchUp.skip:
+                logger.info("%s missed its tick at %s; skipping", self.name,
+                            next_run)
+                STATE.compare_and_set(self.name, "last_run", last_run_str,
+                                      Time.get(curr_time))
+                return False
+            if missed and self.catchup == CatchUp.replay:
+                run_time = next_run
+
+        # Claims the run, in case another process got to it first.
+        if not self._acquire(curr_time, node):
+            return False
+        if not STATE.compare_and_set(self.name, "last_run", last_run_str,
+                                     Time.get(run_time)):
+            self.finish_run()
+            return False
+        return True
 
     def props(self) -> Dict[str, Any]:
-        return {**super().props(), "cron_run_mode": self.run_mode}
+        props = {**super().props(), "cron_run_mode": self.run_mode}
+        if self.catchup != CatchUp.coalesce:
+            props["catchup"] = self.catchup.value
+        return props
@@ -2,7 +2,8 @@
 
 import logging
 from abc import ABC, abstractmethod
-from typing import Dict, Union
+from datetime import datetime
+from typing import Any, Dict, Optional, Union
 
 import flask
 from bots.backends.base import BaseBackend
@@ -11,9 +12,20 @@ logger = logging.getLogger(__name__)
 
 
 class FlaskBackend(BaseBackend, ABC):
-    """Provides a Flask-specific backend interface."""
+    """Provides a Flask-specific backend interface.
+
+    Responses get `Cache-Control: max-age=<cache_max_age>` (zero by default,
+    meaning clients should revalidate every time). Backends which can cheaply
+    tell whether their content changed should override `etag` and
+    `last_modified`, so that the endpoint can answer conditional requests
+    without calling `run_flask`.
+    """
+
+    interface = "flask"
 
     def __init__(self, name: str, config: Dict[str, str]) -> None:
+        # Parses how long clients may cache responses, in seconds.
+        self.cache_max_age = int(config.pop("cache_max_age", "0"))
 
         super().__init__(name, config)
 
@@ -21,5 +33,18 @@ class FlaskBackend(BaseBackend, ABC):
     def run_flask(self) -> Union[str, flask.Response]:
         """Runs the backend, returning a Flask response."""
 
+    def etag(self) -> Optional[str]:
+        """Gets a validator for the current content, if it is cheap to get."""
+
+        return None
+
+    def last_modified(self) -> Optional[datetime]:
+        """Gets when the content last changed, if it is known."""
+
+        return None
+
     async def run(self) -> None:
         logger.info("`flask-backend` doesn't need to implement `run`")
+
+    def props(self) -> Dict[str, Any]:
+        return {**super().props(), "cache_max_age": self.cache_max_age}
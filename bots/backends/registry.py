@@ -1,41 +1,98 @@
 #!/usr/bin/env python
 
-from typing import Callable, Dict, List, Type
+import importlib
+from typing import Callable, Dict, List, Optional, Tuple, Type
 
 from bots.backends.base import BaseBackend
 
+# Maps each backend type to the module which registers it, and the endpoint
+# interface it implements. Implementations are only imported the first time
+# their type is requested, so that entry points don't pay for importing
+# heavy dependencies of unused backends, and can filter backends by their
+# interface without importing them.
+MANIFEST: Dict[str, Tuple[str, str]] = {
+    "newegg-availability": ("bots.backends.implementations.newegg", "cron"),
+    "newegg-availability-graph":
+        ("bots.backends.implementations.newegg", "cron"),
+    "newegg-alert": ("bots.backends.implementations.newegg_alert", "cron"),
+    "newegg-export":
+        ("bots.backends.implementations.newegg_export", "flask"),
+    "shell": ("bots.backends.implementations.shell", "cron"),
+    "simple-website":
+        ("bots.backends.implementations.simple_website", "flask"),
+}
+
 
 class _Registry:
     """Maps backend names to their instantiations."""
 
-    def __init__(self) -> None:
+    def __init__(self, manifest: Dict[str, Tuple[str, str]]) -> None:
+        self.manifest = manifest
         self.backends: Dict[str, Type[BaseBackend]] = {}
 
-    def register_backend(self, name: str) -> Callable[[Type[BaseBackend]], None]:
+    def register_backend(
+        self,
+        name: str,
+    ) -> Callable[[Type[BaseBackend]], Type[BaseBackend]]:
         """Adds the backend to the backend registry.
 
-        After importing all the backends, the REGISTRY singleton will be
-        populated, allowing backends to be instantiated from their names.
+        Implementation modules call this when they are imported. Backends
+        which are listed in the manifest are imported on demand by `get`.
         """
 
-        def _wrapper(backend: Type[BaseBackend]) -> None:
+        def _wrapper(backend: Type[BaseBackend]) -> Type[BaseBackend]:
             assert issubclass(backend, BaseBackend), backend
+            if name in self.manifest:
+                assert backend.interface == self.manifest[name][1], \
+                    f"{name} implements {backend.interface}, but the " \
+                    f"manifest lists {self.manifest[name][1]}"
             self.backends[name] = backend
+            return backend
 
         return _wrapper
 
+    def get(self, name: str) -> Type[BaseBackend]:
+        """Gets a backend type, importing its module if needed."""
+
+        if name not in self.backends and name in self.manifest:
+            importlib.import_module(self.manifest[name][0])
+        if name not in self.backends:
+            raise KeyError(f"Backend '{name}' not found; available: "
+                           f"{self.types}")
+        return self.backends[name]
+
+    def interface(self, name: str) -> Optional[str]:
+        """Gets the interface of a backend type, without importing it."""
+
+        if name in self.manifest:
+            return self.manifest[name][1]
+        return self.get(name).interface
+
+    def load_all(self) -> Dict[str, Type[BaseBackend]]:
+        """Imports every backend in the manifest."""
+
+        for name in self.manifest:
+            self.get(name)
+        return self.backends
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.backends or name in self.manifest
+
     @property
     def types(self) -> List[str]:
-        return list(self.backends.keys())
+        return list(dict.fromkeys([*self.manifest, *self.backends]))
 
-    def __repr__(self) -> str:
-        items = "\n".join([
-            f"{name}: {backend.help()}"
-            for name, backend in self.backends.items()
-        ])
+    def describe(self, names: List[str]) -> str:
+        """Gets the help of some backend types, importing only those."""
+
+        items = "\n".join(
+            [f"{name}: {self.get(name).help()}" for name in names])
         return f"-------\nRegistry\n-------\n\n{items}"
 
+    def __repr__(self) -> str:
+        return self.describe(self.types)
+
 
-REGISTRY = _Registry()
+REGISTRY = _Registry(MANIFEST)
 
 register = REGISTRY.register_backend
@@ -1,14 +1,21 @@
 #!/usr/bin/env python
 
 import functools
+import json
+import logging
 import os
+import threading
+import time
 import warnings
 from configparser import ConfigParser
 from pathlib import Path
-from typing import Callable, Dict, Optional, Type
+from typing import Callable, Dict, List, Optional, Tuple
 
 from bots.backends.base import BaseBackend
 from bots.backends.registry import REGISTRY
+from bots.dag import find_cycle
+
+logger = logging.getLogger(__name__)
 
 
 class ConfigParseException(Exception):
@@ -36,38 +43,236 @@ def get_config_path() -> Path:
                             f"one of {cfg_files}")
 
 
-@functools.lru_cache(None)
-def parse_config(
-    cfg_file: Optional[Path] = None,
-    should_instantiate: Optional[Callable[[Type[BaseBackend], str], bool]] = None,
-) -> Dict[str, BaseBackend]:
+def read_config(cfg_file: Optional[Path] = None) -> ConfigParser:
+    """Reads the raw config, without instantiating any backends."""
+
     if cfg_file is None:
         cfg_file = get_config_path()
 
     config = ConfigParser()
     config.read(cfg_file)
+    return config
 
-    backends: Dict[str, BaseBackend] = {}
-    for section in config.sections():
-        items = {k: v for k, v in config[section].items()}
 
-        if "type" not in items:
-            warnings.warn(f"Section [{section}] missing `type` key; skipping")
-            continue
+def check_dependencies(config: ConfigParser) -> Dict[str, List[str]]:
+    """Checks that dependencies exist and don't form a cycle.
+
+    Args:
+        config: The raw config
 
-        btype = items.pop("type")
-        if btype not in REGISTRY.backends:
-            available = list(REGISTRY.backends.keys())
-            raise ConfigParseException(f"Backend '{btype}' not found; "
-                                       f"available: {available}")
+    Returns:
+        The dependencies of each section
+    """
 
+    depends: Dict[str, List[str]] = {}
+    for section in config.sections():
         try:
-            backend_type = REGISTRY.backends[btype]
-            if should_instantiate is None:
-                backends[section] = backend_type(section, items)
-            elif should_instantiate(backend_type, section):
-                backends[section] = backend_type(section, items)
-        except Exception as exp:
-            raise ConfigParseException from exp
+            depends[section] = json.loads(config[section].get("depends", "[]"))
+        except json.JSONDecodeError as exp:
+            raise ConfigParseException(f"Section [{section}] has invalid "
+                                       "`depends`") from exp
+
+    for section, deps in depends.items():
+        missing = [dep for dep in deps if dep not in depends]
+        if missing:
+            raise ConfigParseException(f"Section [{section}] depends on "
+                                       f"missing sections: {missing}")
+
+    cycle = find_cycle(depends)
+    if cycle is not None:
+        raise ConfigParseException(f"Dependency cycle: {' -> '.join(cycle)}")
+
+    return depends
+
 
+def _build_backend(
+    section: str,
+    items: Dict[str, str],
+    should_instantiate: Optional[Callable[[Optional[str], str], bool]],
+) -> Optional[BaseBackend]:
+    """Builds one backend, if `should_instantiate` accepts it.
+
+    `should_instantiate` gets the backend's interface and section name. It
+    is called before the implementation is imported, so that endpoints
+    don't import the dependencies of backends they won't run.
+    """
+
+    items = dict(items)
+    if "type" not in items:
+        warnings.warn(f"Section [{section}] missing `type` key; skipping")
+        return None
+
+    btype = items.pop("type")
+    if btype not in REGISTRY:
+        raise ConfigParseException(f"Backend '{btype}' not found; "
+                                   f"available: {REGISTRY.types}")
+
+    try:
+        if should_instantiate is not None and not should_instantiate(
+                REGISTRY.interface(btype), section):
+            return None
+        return REGISTRY.get(btype)(section, items)
+    except Exception as exp:
+        raise ConfigParseException from exp
+
+
+def _sections(config: ConfigParser) -> Dict[str, Dict[str, str]]:
+    return {s: {k: v for k, v in config[s].items()} for s in config.sections()}
+
+
+@functools.lru_cache(None)
+def parse_config(
+    cfg_file: Optional[Path] = None,
+    should_instantiate: Optional[Callable[[Optional[str], str], bool]] = None,
+) -> Dict[str, BaseBackend]:
+    config = read_config(cfg_file)
+    check_dependencies(config)
+
+    backends: Dict[str, BaseBackend] = {}
+    for section, items in _sections(config).items():
+        backend = _build_backend(section, items, should_instantiate)
+        if backend is not None:
+            backends[section] = backend
+
+    return backends
+
+
+def build_backends(
+    config: ConfigParser,
+    sections: List[str],
+) -> Dict[str, BaseBackend]:
+    """Builds the backends for just the given sections of the raw config.
+
+    Building a backend only parses its config; connections and files are
+    opened when it is first run or served, and released by `close`.
+
+    Args:
+        config: The raw config
+        sections: The sections to build
+
+    Returns:
+        The backends, keyed by section
+    """
+
+    backends: Dict[str, BaseBackend] = {}
+    for section in sections:
+        items = {k: v for k, v in config[section].items()}
+        backend = _build_backend(section, items, None)
+        if backend is not None:
+            backends[section] = backend
     return backends
+
+
+class LiveConfig:
+    """Keeps the backends in sync with the config file.
+
+    The file is polled at most once every `check_interval` seconds. When it
+    changes, the sections are diffed against the last good config; only
+    the backends whose sections were added or changed are built, and the
+    ones whose sections were removed or changed are retired, so they are
+    closed once the runs and requests still using them finish. The new set
+    of backends is swapped in all at once, so readers see either the old
+    config or the new one. If the new config is invalid, the old backends
+    are kept and the error is logged.
+    """
+
+    def __init__(
+        self,
+        cfg_file: Optional[Path] = None,
+        should_instantiate: Optional[
+            Callable[[Optional[str], str], bool]] = None,
+        check_interval: float = 1.0,
+    ) -> None:
+        self.cfg_file = cfg_file
+        self.should_instantiate = should_instantiate
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._stat: Optional[Tuple[int, int]] = None
+        self._last_check = float("-inf")
+        self._sections: Dict[str, Dict[str, str]] = {}
+        self._backends: Dict[str, BaseBackend] = {}
+
+    def path(self) -> Path:
+        return get_config_path() if self.cfg_file is None else self.cfg_file
+
+    def backends(self) -> Dict[str, BaseBackend]:
+        """Gets the current backends, reloading the config if it changed.
+
+        The returned dictionary is never mutated, so it is safe to keep
+        using it while the config is reloaded.
+
+        Returns:
+            The backends for the most recent valid config
+        """
+
+        if time.monotonic() - self._last_check >= self.check_interval:
+            self.refresh()
+        return self._backends
+
+    def refresh(self) -> bool:
+        """Reloads the config if the file changed.
+
+        Returns:
+            If the backends were changed
+        """
+
+        with self._lock:
+            self._last_check = time.monotonic()
+            path = self.path()
+            try:
+                stat = path.stat()
+            except OSError:
+                # Editors may briefly remove the file while saving it.
+                if self._stat is None:
+                    raise
+                logger.warning("Couldn't stat %s; keeping the old config",
+                               path)
+                return False
+            key = (stat.st_mtime_ns, stat.st_size)
+            if key == self._stat:
+                return False
+            self._stat = key
+
+            try:
+                config = read_config(path)
+                check_dependencies(config)
+            except ConfigParseException:
+                logger.exception("Invalid config %s; keeping the old one", path)
+                return False
+
+            sections = _sections(config)
+            unchanged = {
+                k for k, v in sections.items() if self._sections.get(k) == v
+            }
+            backends = {
+                k: v for k, v in self._backends.items() if k in unchanged
+            }
+            built: List[BaseBackend] = []
+            try:
+                for section, items in sections.items():
+                    if section in unchanged:
+                        continue
+                    backend = _build_backend(section, items,
+                                             self.should_instantiate)
+                    if backend is not None:
+                        built.append(backend)
+                        backends[section] = backend
+            except ConfigParseException:
+                logger.exception("Invalid config %s; keeping the old one", path)
+                for backend in built:
+                    backend.close()
+                return False
+
+            stale = [
+                v for k, v in self._backends.items() if k not in unchanged
+            ]
+            changed = bool(built or stale)
+            self._sections, self._backends = sections, backends
+
+        for backend in stale:
+            logger.info("Retiring %s", backend.name)
+            backend.retire()
+        if changed:
+            logger.info("Reloaded %s", path)
+        return changed
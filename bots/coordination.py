@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""Coordinates several nodes running the same bot config.
+
+Nodes share a SQLite file, for example on a network mount, which holds a
+heartbeat for each node and a lease for each bot which is running. Bots are
+spread over the live nodes with a consistent hash ring, so adding or losing
+a node only moves the bots which hashed to it. A node only runs a bot after
+taking its lease, which is renewed while the bot runs and expires if the
+node dies, so another node can take over. Leases are held by a token which
+is unique to each process, so two processes on the same node can't take
+or release each other's leases, and a run whose lease can't be renewed is
+stopped.
+
+For the nodes to agree on when each bot last ran, they should also share
+the state store, by pointing `BOTS_STATE_CONFIG` at a shared SQLite file.
+"""
+
+import asyncio
+import bisect
+import contextlib
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    """Raised when a run is stopped because its lease couldn't be renewed."""
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Assigns keys to nodes by consistent hashing.
+
+    Each node is placed at `replicas` points on the ring, and a key belongs
+    to the first node at or after the key's hash.
+    """
+
+    def __init__(self, nodes: Sequence[str], replicas: int = 64) -> None:
+        points: List[Tuple[int, str]] = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in nodes
+            for i in range(replicas))
+        self.hashes = [h for h, _ in points]
+        self.nodes = [n for _, n in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self.nodes:
+            return None
+        i = bisect.bisect_left(self.hashes, _hash(key)) % len(self.nodes)
+        return self.nodes[i]
+
+
+class LeaseStore:
+    """Stores node heartbeats and bot leases in SQLite.
+
+    Every write happens in its own immediate transaction, so nodes never
+    see a half-taken lease.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS nodes (
+                node text NOT NULL PRIMARY KEY,
+                heartbeat real NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                bot text NOT NULL PRIMARY KEY,
+                node text NOT NULL,
+                token text NOT NULL,
+                expires real NOT NULL
+            ) WITHOUT ROWID
+        """)
+
+    def heartbeat(self, node: str, now: float) -> None:
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO nodes VALUES (?, ?)",
+                              (node, now))
+
+    def remove_node(self, node: str) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM nodes WHERE node = ?", (node, ))
+
+    def live_nodes(self, since: float) -> List[str]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT node FROM nodes WHERE heartbeat >= ? ORDER BY node",
+                (since, )).fetchall()
+        return [row[0] for row in rows]
+
+    def acquire(
+        self,
+        bot: str,
+        node: str,
+        token: str,
+        now: float,
+        ttl: float,
+    ) -> bool:
+        """Takes the lease if it is free or expired.
+
+        A live lease is never taken, even by the token holding it, since it
+        means a run of the bot is still in progress.
+        """
+
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT node, expires FROM leases WHERE bot = ?",
+                    (bot, )).fetchone()
+                if row is not None and row[1] > now:
+                    return False
+                if row is not None:
+                    logger.warning("Taking over %s from %s, whose lease "
+                                   "expired", bot, row[0])
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO leases VALUES (?, ?, ?, ?)",
+                    (bot, node, token, now + ttl))
+                return True
+            finally:
+                self.conn.execute("COMMIT")
+
+    def renew(self, bot: str, token: str, now: float, ttl: float) -> bool:
+        """Extends the lease, if it is still held by the token."""
+
+        with self.lock:
+            cur = self.conn.execute(
+                "UPDATE leases SET expires = ? WHERE bot = ? AND token = ?",
+                (now + ttl, bot, token))
+        return cur.rowcount > 0
+
+    def release(self, bot: str, token: str) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM leases WHERE bot = ? AND token = ?",
+                              (bot, token))
+
+    def leases(self) -> Dict[str, Tuple[str, float]]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT bot, node, expires FROM leases").fetchall()
+        return {bot: (node, expires) for bot, node, expires in rows}
+
+
+class Coordinator:
+    """Decides which bots this node runs, and holds their leases.
+
+    Args:
+        path: The shared SQLite file
+        node: The name of this node; defaults to the host name
+        lease_ttl: How long a lease lasts without being renewed, in seconds;
+            leases are renewed three times per TTL while the bot runs
+        node_ttl: How long a node counts as live after its last heartbeat;
+            this should be longer than the time between cron invocations
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        node: Optional[str] = None,
+        lease_ttl: float = 60.0,
+        node_ttl: float = 180.0,
+    ) -> None:
+        self.store = LeaseStore(path)
+        self.node = socket.gethostname() if node is None else node
+        self.token = f"{self.node}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.lease_ttl = lease_ttl
+        self.node_ttl = node_ttl
+
+    def heartbeat(self) -> None:
+        self.store.heartbeat(self.node, time.time())
+
+    def ring(self) -> HashRing:
+        nodes = self.store.live_nodes(time.time() - self.node_ttl)
+        if self.node not in nodes:
+            nodes.append(self.node)
+        return HashRing(nodes)
+
+    def assigned(self, bots: Sequence[str]) -> List[str]:
+        """Gets the bots which hash to this node."""
+
+        self.heartbeat()
+        ring = self.ring()
+        return [bot for bot in bots if ring.owner(bot) == self.node]
+
+    def acquire(self, bot: str) -> bool:
+        return self.store.acquire(bot, self.node, self.token, time.time(),
+                                  self.lease_ttl)
+
+    def release(self, bot: str) -> None:
+        self.store.release(bot, self.token)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, bots: Sequence[str]) -> AsyncIterator[None]:
+        """Renews the leases on the bots until the block exits.
+
+        The leases should already have been acquired; they are released on
+        exit. The node heartbeat is refreshed along with the leases.
+
+        Raises:
+            LeaseLost: If a lease couldn't be renewed, in which case another
+                node may have taken it over; the block is cancelled
+        """
+
+        owner = asyncio.current_task()
+        lost: List[str] = []
+
+        async def renew() -> None:
+            while True:
+                await asyncio.sleep(self.lease_ttl / 3)
+                now = time.time()
+                self.store.heartbeat(self.node, now)
+                lost.extend(bot for bot in bots if not self.store.renew(
+                    bot, self.token, now, self.lease_ttl))
+                if lost:
+                    logger.error("Lost the leases on %s; stopping the run",
+                                 lost)
+                    if owner is not None:
+                        owner.cancel()
+                    return
+
+        task = asyncio.create_task(renew())
+        try:
+            yield
+        except asyncio.CancelledError:
+            if not lost:
+                raise
+            raise LeaseLost(f"Lost the leases on {lost}") from None
+        finally:
+            task.cancel()
+            for bot in bots:
+                if bot not in lost:
+                    self.release(bot)
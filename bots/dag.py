@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+from typing import Dict, List, Optional, Set
+
+
+def find_cycle(depends: Dict[str, List[str]]) -> Optional[List[str]]:
+    """Finds a dependency cycle, if one exists.
+
+    Args:
+        depends: Mapping from each node to the nodes it depends on
+
+    Returns:
+        The nodes in the cycle, with the first node repeated at the end, or
+        None if the graph is acyclic
+    """
+
+    visiting: List[str] = []
+    done: Set[str] = set()
+
+    def visit(node: str) -> Optional[List[str]]:
+        if node in done:
+            return None
+        if node in visiting:
+            return visiting[visiting.index(node):] + [node]
+        visiting.append(node)
+        for dep in depends.get(node, []):
+            cycle = visit(dep)
+            if cycle is not None:
+                return cycle
+        visiting.pop()
+        done.add(node)
+        return None
+
+    for node in depends:
+        cycle = visit(node)
+        if cycle is not None:
+            return cycle
+    return None
+
+
+def expand(nodes: List[str], depends: Dict[str, List[str]]) -> List[str]:
+    """Adds the transitive dependencies of the nodes, keeping their order."""
+
+    expanded: Dict[str, None] = {}
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        if node in expanded:
+            continue
+        expanded[node] = None
+        stack.extend(reversed(depends.get(node, [])))
+    return list(expanded)
+
+
+def topological_order(depends: Dict[str, List[str]]) -> List[str]:
+    """Orders the nodes so that each node comes after its dependencies.
+
+    Dependencies which aren't keys of `depends` are ignored.
+    """
+
+    order: List[str] = []
+    done: Set[str] = set()
+
+    def visit(node: str) -> None:
+        if node in done:
+            return
+        done.add(node)
+        for dep in depends[node]:
+            if dep in depends:
+                visit(dep)
+        order.append(node)
+
+    for node in depends:
+        visit(node)
+    return order
+
+
+def critical_path(
+    depends: Dict[str, List[str]],
+    weights: Dict[str, float],
+) -> Dict[str, float]:
+    """Gets the length of the longest chain starting at each node.
+
+    Args:
+        depends: Mapping from each node to the nodes it depends on
+        weights: The expected cost of each node
+
+    Returns:
+        Mapping from each node to the total weight of the heaviest path from
+        that node through its dependents
+    """
+
+    dependents: Dict[str, List[str]] = {node: [] for node in depends}
+    for node, deps in depends.items():
+        for dep in deps:
+            if dep in dependents:
+                dependents[dep].append(node)
+
+    lengths: Dict[str, float] = {}
+    for node in reversed(topological_order(depends)):
+        tail = max((lengths[d] for d in dependents[node]), default=0.0)
+        lengths[node] = weights.get(node, 1.0) + tail
+    return lengths
@@ -6,14 +6,15 @@ import textwrap
 
 import coloredlogs
 from bots.backends.registry import REGISTRY
-from bots.backends.run import run_sync
-from bots.config import parse_config
+from bots.profiling import add_profile_args, get_profiler
+from bots.run import run_sync
+from bots.config import read_config
 
 logger = logging.getLogger(__name__)
 
 DESCRIPTION = textwrap.dedent("""
     Tool for running bots from the command line. By default, this runs all
-    available bots.
+    available cron bots.
 """)
 
 
@@ -21,6 +22,11 @@ def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description=DESCRIPTION)
     parser.add_argument("-b", "--bots", nargs="+", default=[],
                         help="Names of the bots to run")
+    parser.add_argument("-j", "--max-concurrency", type=int, default=None,
+                        help="Maximum number of bots to run at once")
+    parser.add_argument("-w", "--with-depends", action="store_true",
+                        help="If set, also run the bots' dependencies")
+    add_profile_args(parser)
     return parser.parse_args()
 
 
@@ -28,14 +34,27 @@ def main() -> None:
     coloredlogs.install(level="INFO")
     args = parse_args()
 
-    print(REGISTRY)
-
-    backends = parse_config()
-    available = list(backends.keys())
+    config = read_config()
+    types = {
+        s: config[s]["type"]
+        for s in config.sections()
+        if "type" in config[s] and config[s]["type"] in REGISTRY
+    }
     if not args.bots:
-        args.bots = available
-
-    run_sync(args.bots)
+        args.bots = [
+            s for s, t in types.items() if REGISTRY.interface(t) == "cron"
+        ]
+
+    # Only imports the implementations of the bots being run.
+    print(REGISTRY.describe(
+        list(dict.fromkeys(types[b] for b in args.bots if b in types))))
+
+    profiler = get_profiler(args)
+    run_sync(args.bots, args.max_concurrency, args.with_depends,
+             profiler=profiler)
+    if profiler is not None:
+        for name in profiler.names:
+            print(profiler.summary(name))
 
 
 if __name__ == "__main__":
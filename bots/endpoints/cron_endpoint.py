@@ -1,18 +1,27 @@
 #!/usr/bin/env python
 
 import argparse
+import asyncio
+import heapq
+import logging
 import sys
 import textwrap
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List, Type
+from typing import Dict, List, Optional, Set, Tuple
 
 from bots.backends.base import BaseBackend
 from bots.backends.interfaces.cron_interface import CronBackend
-from bots.config import get_config_path, parse_config
-from bots.run import run_sync
+from bots.config import LiveConfig, get_config_path, parse_config
+from bots.coordination import Coordinator
+from bots.http_client import close_client
+from bots.profiling import Profiler, add_profile_args, get_profiler
+from bots.run import run
 from bots.state import STATE
 from termcolor import colored
 
+logger = logging.getLogger(__name__)
+
 
 def get_tab() -> str:
     root = Path(__file__).absolute().parent.parent.parent
@@ -38,7 +47,9 @@ DESCRIPTION = textwrap.dedent(f"""
         {get_tab()}
 
     This runs the Python script every minute, which in turn decides whether
-    or not to run each bot.
+    or not to run each bot. Alternatively, pass `--daemon` to keep a single
+    process resident, which sleeps until the next bot is due and picks up
+    changes to the config without restarting.
 """)
 
 
@@ -51,33 +62,275 @@ def parse_args() -> argparse.Namespace:
                         help="If set, print verbose")
     parser.add_argument("-b", "--bots", nargs="+", default=[],
                         help="Specific bot names to run")
+    parser.add_argument("-j", "--max-concurrency", type=int, default=None,
+                        help="Maximum number of bots to run at once")
+    parser.add_argument("-d", "--daemon", action="store_true",
+                        help="If set, run as a resident scheduler")
+    parser.add_argument("--min-interval", type=float, default=60.0,
+                        help="Minimum seconds between runs of one bot, "
+                        "when running as a daemon")
+    parser.add_argument("--config-interval", type=float, default=5.0,
+                        help="Seconds between checks for config changes, "
+                        "when running as a daemon")
+    parser.add_argument("--coordinate", type=Path, default=None,
+                        help="Shared SQLite file for running on several "
+                        "nodes; each bot runs on one node at a time")
+    parser.add_argument("--node", default=None,
+                        help="Name of this node; defaults to the host name")
+    parser.add_argument("--lease-ttl", type=float, default=60.0,
+                        help="Seconds before an unrenewed bot lease expires")
+    parser.add_argument("--node-ttl", type=float, default=180.0,
+                        help="Seconds before a silent node is considered "
+                        "dead, and its bots are moved to other nodes")
+    add_profile_args(parser)
     return parser.parse_args()
 
 
-def get_bots(bots: List[str]) -> List[str]:
+def is_cron_backend(interface: Optional[str], name: str) -> bool:
+    return interface == "cron"
+
+
+def get_backends(bots: List[str]) -> Dict[str, CronBackend]:
 
-    def should_instantiate(t: Type[BaseBackend], name: str) -> bool:
+    def should_instantiate(interface: Optional[str], name: str) -> bool:
         if bots:
-            return issubclass(t, CronBackend) and name in bots
+            return is_cron_backend(interface, name) and name in bots
         else:
-            return issubclass(t, CronBackend)
+            return is_cron_backend(interface, name)
 
     backends = parse_config(should_instantiate=should_instantiate)
-    return [
-        k for k, v in backends.items()
-        if isinstance(v, CronBackend) and v.should_run()
-    ]
+    return {k: v for k, v in backends.items() if isinstance(v, CronBackend)}
+
+
+def claim(
+    backend: CronBackend,
+    coordinator: Optional[Coordinator] = None,
+) -> bool:
+    """Checks if the backend is due, and claims it for this node.
+
+    Without a coordinator, this is just `should_run`. With one, the bot must
+    also hash to this node, and its lease must be free; the lease is kept
+    only if the bot is due.
+    """
+
+    if coordinator is None:
+        return backend.should_run()
+    if not coordinator.assigned([backend.name]):
+        return False
+    if not coordinator.acquire(backend.name):
+        logger.info("%s is running on another node", backend.name)
+        return False
+    if backend.should_run(coordinator.node):
+        return True
+    coordinator.release(backend.name)
+    return False
+
+
+def claim_all(
+    bots: List[str],
+    coordinator: Optional[Coordinator] = None,
+) -> List[CronBackend]:
+    return [v for v in get_backends(bots).values() if claim(v, coordinator)]
+
+
+def get_bots(
+    bots: List[str],
+    coordinator: Optional[Coordinator] = None,
+) -> List[str]:
+    return [backend.name for backend in claim_all(bots, coordinator)]
+
+
+def _cron_backends(
+    backends: Dict[str, BaseBackend],
+    bots: List[str],
+) -> Dict[str, CronBackend]:
+    return {
+        k: v
+        for k, v in backends.items()
+        if isinstance(v, CronBackend) and (not bots or k in bots)
+    }
+
+
+async def run_claimed(
+    claimed: List[CronBackend],
+    coordinator: Optional[Coordinator],
+    max_concurrency: Optional[int] = None,
+    backends: Optional[Dict[str, BaseBackend]] = None,
+    profiler: Optional[Profiler] = None,
+) -> None:
+    """Runs claimed bots, then releases their run locks and leases.
+
+    Args:
+        claimed: The bots which were claimed with `claim`
+        coordinator: The coordinator the leases were taken from, if any
+        max_concurrency: The maximum number of bots to run at once
+        backends: The backends to run; defaults to building them from the
+            config
+        profiler: If set, profiles each bot
+    """
+
+    bots = [backend.name for backend in claimed]
+    try:
+        if coordinator is None:
+            await run(bots, max_concurrency, backends=backends,
+                      profiler=profiler)
+        else:
+            async with coordinator.hold(bots):
+                await run(bots, max_concurrency, backends=backends,
+                          profiler=profiler)
+    finally:
+        for backend in claimed:
+            backend.finish_run()
+
+
+async def run_daemon(
+    config: LiveConfig,
+    bots: List[str],
+    min_interval: timedelta,
+    max_concurrency: Optional[int] = None,
+    profiler: Optional[Profiler] = None,
+    coordinator: Optional[Coordinator] = None,
+) -> None:
+    """Runs the backends forever, sleeping until the next one is due.
+
+    The queue holds the next fire time of each backend. A backend is only
+    put back on the queue after its run finishes, so a slow bot is never
+    dispatched twice at once. The config is checked for changes at least
+    once every `config.check_interval` seconds; when it changes, the queue
+    is rebuilt from the new backends, and bots that were removed are
+    dropped once their current run finishes.
+
+    Args:
+        config: The live config to take the backends from
+        bots: The names of the bots to schedule; if empty, schedules all
+            the cron backends
+        min_interval: The minimum time between two runs of the same backend
+        max_concurrency: The maximum number of bots to run at once, per batch
+        profiler: If set, profiles each bot, logging a summary after each run
+        coordinator: If set, only runs the bots assigned to this node, under
+            a lease
+    """
+
+    snapshot = config.backends()
+    backends = _cron_backends(snapshot, bots)
+    queue: List[Tuple[datetime, str]] = []
+    last_dispatch: Dict[str, datetime] = {}
+    in_flight: Set[str] = set()
+    running: Set["asyncio.Task[None]"] = set()
+    wakeup = asyncio.Event()
+
+    def schedule(name: str) -> None:
+        if name not in backends:
+            return
+        next_run = backends[name].next_run()
+        if next_run is None:
+            return
+        if name in last_dispatch:
+            next_run = max(next_run, last_dispatch[name] + min_interval)
+        heapq.heappush(queue, (next_run, name))
+
+    async def dispatch(claimed: List[CronBackend]) -> None:
+        names = [backend.name for backend in claimed]
+        try:
+            await run_claimed(claimed, coordinator, max_concurrency, snapshot,
+                              profiler)
+        except Exception:
+            logger.exception("Got exception while running %s", names)
+        finally:
+            STATE.save()
+            if profiler is not None:
+                for name in names:
+                    logger.info("%s", profiler.summary(name))
+            in_flight.difference_update(names)
+            for name in names:
+                schedule(name)
+            wakeup.set()
+
+    for name in backends:
+        schedule(name)
+
+    try:
+        while True:
+            wakeup.clear()
+            timeout = config.check_interval
+            if queue:
+                due_in = (queue[0][0] - datetime.now()).total_seconds()
+                timeout = min(timeout, due_in)
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            if coordinator is not None:
+                coordinator.heartbeat()
+            if config.backends() is not snapshot:
+                snapshot = config.backends()
+                backends = _cron_backends(snapshot, bots)
+                queue.clear()
+                for name in backends:
+                    if name not in in_flight:
+                        schedule(name)
+
+            now = datetime.now()
+            due: List[str] = []
+            while queue and queue[0][0] <= now:
+                _, name = heapq.heappop(queue)
+                if claim(backends[name], coordinator):
+                    last_dispatch[name] = now
+                    due.append(name)
+                else:
+                    heapq.heappush(queue, (now + min_interval, name))
+
+            if due:
+                in_flight.update(due)
+                task = asyncio.create_task(
+                    dispatch([backends[name] for name in due]))
+                running.add(task)
+                task.add_done_callback(running.discard)
+    finally:
+        await close_client()
 
 
 def main() -> None:
     args = parse_args()
 
-    bots = get_bots(args.bots)
+    coordinator = None
+    if args.coordinate is not None:
+        coordinator = Coordinator(args.coordinate, args.node, args.lease_ttl,
+                                  args.node_ttl)
+
+    if args.daemon:
+        config = LiveConfig(should_instantiate=is_cron_backend,
+                            check_interval=args.config_interval)
+        if args.verbose:
+            for bot in _cron_backends(config.backends(), args.bots):
+                print(f"Scheduling {colored(bot, 'green')}")
+        min_interval = timedelta(seconds=args.min_interval)
+        max_concurrency = args.max_concurrency
+        asyncio.run(
+            run_daemon(config, args.bots, min_interval, max_concurrency,
+                       get_profiler(args), coordinator))
+        return
+
+    claimed = claim_all(args.bots, coordinator)
 
     if args.verbose:
-        for bot in bots:
-            print(f"Running {colored(bot, 'green')}")
-    run_sync(bots)
+        for backend in claimed:
+            print(f"Running {colored(backend.name, 'green')}")
+    profiler = get_profiler(args)
+
+    async def _run() -> None:
+        try:
+            await run_claimed(claimed, coordinator, args.max_concurrency,
+                              profiler=profiler)
+        finally:
+            await close_client()
+
+    asyncio.run(_run())
+    if profiler is not None:
+        for name in profiler.names:
+            print(profiler.summary(name))
 
 
 if __name__ == "__main__":
@@ -6,29 +6,160 @@ To run this on a server, can use:
     gunicorn python -m bots.endpoints.flask_endpoint
 """
 
-from typing import Type, Union
+import collections
+import gzip
+import hashlib
+import threading
+from typing import Callable, Dict, Optional, Tuple, Union
 
 import flask
-from bots.backends.base import BaseBackend
 from bots.backends.interfaces.flask_interface import FlaskBackend
-from bots.config import parse_config
+from bots.config import LiveConfig
+from bots.metrics import METRICS
 
 app = flask.Flask(__name__)
 
+# Responses smaller than this aren't worth compressing.
+MIN_COMPRESS_SIZE = 512
 
-def is_flask_backend(t: Type[BaseBackend], name: str) -> bool:
-    return issubclass(t, FlaskBackend)
+# Maximum number of compressed bodies to keep.
+MAX_CACHED_BODIES = 256
+
+
+def _brotli_compress() -> Optional[Callable[[bytes], bytes]]:
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress
+
+
+ENCODERS: Dict[str, Callable[[bytes], bytes]] = {
+    "gzip": lambda body: gzip.compress(body, compresslevel=9),
+}
+
+brotli_compress = _brotli_compress()
+if brotli_compress is not None:
+    ENCODERS = {"br": brotli_compress, **ENCODERS}
+
+
+class _CompressedCache:
+    """Keeps compressed variants of response bodies, keyed by ETag."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.bodies: "collections.OrderedDict[Tuple[str, str], bytes]" = \
+            collections.OrderedDict()
+
+    def get(self, etag: str, encoding: str, body: bytes) -> bytes:
+        key = (etag, encoding)
+        with self.lock:
+            if key in self.bodies:
+                self.bodies.move_to_end(key)
+                return self.bodies[key]
+        compressed = ENCODERS[encoding](body)
+        with self.lock:
+            self.bodies[key] = compressed
+            while len(self.bodies) > self.max_size:
+                self.bodies.popitem(last=False)
+        return compressed
+
+
+COMPRESSED = _CompressedCache(MAX_CACHED_BODIES)
+
+
+def is_flask_backend(interface: Optional[str], name: str) -> bool:
+    return interface == "flask"
+
+
+# Reloads the Flask backends when the config file changes.
+CONFIG = LiveConfig(should_instantiate=is_flask_backend)
+
+
+def _choose_encoding() -> Optional[str]:
+    accept = flask.request.accept_encodings
+    for encoding in ENCODERS:
+        if accept[encoding]:
+            return encoding
+    return None
+
+
+def _variant_etag(etag: str, encoding: Optional[str]) -> str:
+    return etag if encoding is None else f"{etag}-{encoding}"
+
+
+def _not_modified(etag: str, backend_obj: FlaskBackend) -> flask.Response:
+    response = flask.Response(status=304)
+    response.set_etag(etag)
+    _set_cache_headers(response, backend_obj)
+    return response
+
+
+def _set_cache_headers(
+    response: flask.Response,
+    backend_obj: FlaskBackend,
+) -> None:
+    response.cache_control.max_age = backend_obj.cache_max_age
+    if not backend_obj.cache_max_age:
+        response.cache_control.no_cache = True
+    response.vary.add("Accept-Encoding")
+    last_modified = backend_obj.last_modified()
+    if last_modified is not None:
+        response.last_modified = last_modified
+
+
+def _respond(backend_obj: FlaskBackend) -> flask.Response:
+    # Answers conditional requests without rendering, when possible.
+    encoding = _choose_encoding()
+    etag = backend_obj.etag()
+    if etag is not None:
+        if flask.request.if_none_match.contains(_variant_etag(etag, encoding)):
+            return _not_modified(_variant_etag(etag, encoding), backend_obj)
+        last_modified = backend_obj.last_modified()
+        since = flask.request.if_modified_since
+        if not flask.request.if_none_match and since is not None and \
+                last_modified is not None and \
+                last_modified.replace(microsecond=0) <= since:
+            return _not_modified(_variant_etag(etag, encoding), backend_obj)
+
+    response = flask.make_response(backend_obj.run_flask())
+    if response.is_streamed or response.status_code != 200:
+        return response
+
+    body = response.get_data()
+    if etag is None:
+        etag = hashlib.sha1(body).hexdigest()
+    if len(body) < MIN_COMPRESS_SIZE or "Content-Encoding" in response.headers:
+        encoding = None
+    variant_etag = _variant_etag(etag, encoding)
+    if flask.request.if_none_match.contains(variant_etag):
+        return _not_modified(variant_etag, backend_obj)
+
+    if encoding is not None:
+        response.set_data(COMPRESSED.get(etag, encoding, body))
+        response.headers["Content-Encoding"] = encoding
+    response.set_etag(variant_etag)
+    _set_cache_headers(response, backend_obj)
+    return response
 
 
 @app.route("/<backend_id>", methods=["GET"])
 def backend(backend_id: str) -> Union[str, flask.Response]:
-    backends = parse_config(should_instantiate=is_flask_backend)
+    backends = CONFIG.backends()
     if backend_id not in backends:
         return flask.abort(404)
     backend_obj = backends[backend_id]
     if not isinstance(backend_obj, FlaskBackend):
         return flask.abort(404)
-    return backend_obj.run_flask()
+    with backend_obj.in_use():
+        return _respond(backend_obj)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics() -> flask.Response:
+    return flask.Response(METRICS.render(),
+                          mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/")
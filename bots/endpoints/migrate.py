@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import argparse
+import logging
+import sqlite3
+import textwrap
+from pathlib import Path
+from typing import List, Set, Tuple
+
+import coloredlogs
+from bots.backends.implementations import newegg_schema as schema
+from bots.config import read_config
+
+logger = logging.getLogger(__name__)
+
+DESCRIPTION = textwrap.dedent("""
+    Tool for migrating Newegg databases to the current schema, in place. By
+    default, this migrates the tables of every Newegg bot in the config.
+""")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("-b", "--bots", nargs="+", default=[],
+                        help="Names of the bots whose tables to migrate")
+    parser.add_argument("--db", type=Path, default=None,
+                        help="Database to migrate, instead of using the config")
+    parser.add_argument("--table", default=None,
+                        help="Table to migrate, with --db")
+    parser.add_argument("--batch-size", type=int, default=10000,
+                        help="Number of rows to copy per transaction")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="If set, reclaim free space afterwards")
+    return parser.parse_args()
+
+
+def get_tables(bots: List[str]) -> List[Tuple[Path, str]]:
+    config = read_config()
+    tables: Set[Tuple[Path, str]] = set()
+    for section in config.sections():
+        items = config[section]
+        if bots and section not in bots:
+            continue
+        if not items.get("type", "").startswith("newegg"):
+            continue
+        tables.add((Path(items["db"]), items["table"]))
+    return sorted(tables)
+
+
+def main() -> None:
+    coloredlogs.install(level="INFO")
+    args = parse_args()
+
+    if args.db is not None:
+        if args.table is None:
+            raise ValueError("--table is required with --db")
+        tables = [(args.db, args.table)]
+    else:
+        tables = get_tables(args.bots)
+
+    for db, table in tables:
+        if not db.exists():
+            logger.info("Skipping %s, which doesn't exist", db)
+            continue
+        conn = sqlite3.connect(db)
+        try:
+            if schema.migrate(conn, table, args.batch_size):
+                logger.info("Migrated %s in %s", table, db)
+            else:
+                logger.info("%s in %s is up to date", table, db)
+            if args.vacuum:
+                conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+import asyncio
+import contextlib
+import email.utils
+import logging
+import random
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class Response:
+    """The parts of an HTTP response that backends care about."""
+
+    def __init__(
+        self,
+        url: str,
+        status: int,
+        content: bytes,
+        headers: Mapping[str, str],
+        not_modified: bool = False,
+    ) -> None:
+        self.url = url
+        self.status = status
+        self.content = content
+        self.headers = headers
+        self.not_modified = not_modified
+
+    def __repr__(self) -> str:
+        return f"Response{{url={self.url}, status={self.status}}}"
+
+
+def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = datetime.now(timezone.utc)
+    return max((parsed - now).total_seconds(), 0.0)
+
+
+class HttpClient:
+    """Provides a pooled, non-blocking HTTP client.
+
+    Connections are kept alive and reused between requests, up to
+    `limit_per_host` concurrent connections per host. Requests which fail
+    with a connection error, a timeout, a 429 or a 5xx are retried with
+    exponential backoff, honoring `Retry-After`. Conditional requests send
+    the `ETag` and `Last-Modified` validators from the previous response
+    for the same URL, and return its cached content on a 304.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 4,
+        timeout: float = 30.0,
+        retries: int = 3,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._session: Optional[Any] = None
+        self._validators: Dict[str, Tuple[Dict[str, str], bytes]] = {}
+
+    @property
+    def session(self) -> Any:
+        if self._session is None:
+            # Imported here, since it is slow to import and most entry
+            # points don't make any requests.
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def _delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        delay = min(self.backoff * 2**attempt, self.max_backoff)
+        return random.uniform(delay / 2, delay)
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        headers: Mapping[str, str],
+        data: Optional[bytes] = None,
+    ) -> Tuple[int, bytes, Mapping[str, str]]:
+        import aiohttp
+
+        attempt = 0
+        while True:
+            try:
+                async with self.session.request(method, url, headers=headers,
+                                                data=data) as resp:
+                    content = await resp.read()
+                    status, resp_headers = resp.status, resp.headers
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exp:
+                if attempt >= self.retries:
+                    raise
+                delay = self._delay(attempt, None)
+                logger.warning("Request to %s failed (%r); retrying in %.1f "
+                               "seconds", url, exp, delay)
+            else:
+                if status not in RETRY_STATUSES or attempt >= self.retries:
+                    return status, content, resp_headers
+                delay = self._delay(attempt, _retry_after(resp_headers))
+                logger.warning("Request to %s got status %d; retrying in "
+                               "%.1f seconds", url, status, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get(
+        self,
+        url: str,
+        headers: Optional[Mapping[str, str]] = None,
+        conditional: bool = False,
+    ) -> Response:
+        """Gets a URL, retrying transient failures.
+
+        Args:
+            url: The URL to get
+            headers: Extra request headers
+            conditional: If set, revalidate against the previous response
+                for this URL instead of downloading it again
+
+        Returns:
+            The final response; responses with retryable statuses are
+            returned once the retries are exhausted
+
+        Raises:
+            aiohttp.ClientError: If the request still fails after retrying
+            asyncio.TimeoutError: If the last attempt timed out
+        """
+
+        request_headers = dict(headers or {})
+        cached = self._validators.get(url) if conditional else None
+        if cached is not None:
+            request_headers.update(cached[0])
+
+        status, content, resp_headers = await self._send(
+            "GET", url, request_headers)
+
+        if status == 304 and cached is not None:
+            return Response(url, status, cached[1], resp_headers, True)
+
+        if conditional and status == 200:
+            validators = {}
+            if "ETag" in resp_headers:
+                validators["If-None-Match"] = resp_headers["ETag"]
+            if "Last-Modified" in resp_headers:
+                validators["If-Modified-Since"] = resp_headers["Last-Modified"]
+            if validators:
+                self._validators[url] = (validators, content)
+
+        return Response(url, status, content, resp_headers)
+
+    async def post(
+        self,
+        url: str,
+        data: bytes,
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> Response:
+        """Posts to a URL, retrying transient failures like `get`.
+
+        The request is retried on a 5xx, so the receiver should tolerate
+        getting the same body twice.
+        """
+
+        status, content, resp_headers = await self._send(
+            "POST", url, dict(headers or {}), data)
+        return Response(url, status, content, resp_headers)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class RateLimiter:
+    """Bounds how many requests are in flight and how often they start.
+
+    This should be created inside the event loop which uses it.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        rate: Optional[float] = None,
+    ) -> None:
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.interval = 0.0 if rate is None else 1.0 / rate
+        self.lock = asyncio.Lock()
+        self.next_start = 0.0
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        async with self.semaphore:
+            async with self.lock:
+                loop = asyncio.get_running_loop()
+                delay = self.next_start - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.next_start = loop.time() + self.interval
+            yield
+
+
+_CLIENTS: Dict[asyncio.AbstractEventLoop, HttpClient] = {}
+
+
+def get_client() -> HttpClient:
+    """Gets the HTTP client shared by all backends on this event loop."""
+
+    loop = asyncio.get_running_loop()
+    if loop not in _CLIENTS:
+        _CLIENTS[loop] = HttpClient()
+    return _CLIENTS[loop]
+
+
+async def close_client() -> None:
+    """Closes the shared HTTP client for this event loop, if there is one."""
+
+    client = _CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
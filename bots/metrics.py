@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+"""Records per-run metrics and renders them for Prometheus.
+
+Each run is appended to a history table, which is pruned to the last
+`HISTORY_DAYS` days. Counters and histogram buckets are kept in a separate
+table and updated in the same transaction, so rendering `/metrics` reads a
+handful of rows per bot and the counters never go backwards when the
+history is pruned.
+"""
+
+import bisect
+import functools
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+           300.0, 600.0, 1800.0, math.inf)
+
+# How long to keep individual runs for.
+HISTORY_DAYS = 30
+
+# Outcomes of bots which didn't actually run, which are left out of the
+# duration and queue wait histograms.
+NOT_RUN = ("skipped", "unchanged")
+
+# A run, as (bot, start, queue_wait, duration, outcome, exception, rows).
+Run = Tuple[str, float, float, float, str, Optional[str], Optional[int]]
+
+
+def _bucket(seconds: float) -> str:
+    le = BUCKETS[bisect.bisect_left(BUCKETS, seconds)]
+    return "+Inf" if math.isinf(le) else repr(le)
+
+
+def _escape(val: str) -> str:
+    return val.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+
+
+class RunHistory:
+    """Stores the history of bot runs in SQLite."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                bot text NOT NULL,
+                start real NOT NULL,
+                queue_wait real NOT NULL,
+                duration real NOT NULL,
+                outcome text NOT NULL,
+                exception text,
+                rows integer,
+                PRIMARY KEY (bot, start)
+            ) WITHOUT ROWID
+        """)
+        self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS runs_start ON runs (start)
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS counters (
+                bot text NOT NULL,
+                name text NOT NULL,
+                label text NOT NULL,
+                val real NOT NULL,
+                PRIMARY KEY (bot, name, label)
+            ) WITHOUT ROWID
+        """)
+
+    def _incr(self, bot: str, name: str, label: str, val: float) -> None:
+        self.conn.execute(
+            """
+            INSERT INTO counters VALUES (?, ?, ?, ?)
+            ON CONFLICT (bot, name, label) DO UPDATE SET val = val + ?
+            """, (bot, name, label, val, val))
+
+    def record(self, run: Run) -> None:
+        """Records a single run.
+
+        Args:
+            run: The run to record
+        """
+
+        bot, start, queue_wait, duration, outcome, exception, rows = run
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    run)
+                self._incr(bot, "runs", outcome, 1)
+                if exception is not None:
+                    self._incr(bot, "exceptions", exception, 1)
+                if rows is not None:
+                    self._incr(bot, "rows", "", rows)
+                if outcome not in NOT_RUN:
+                    self._incr(bot, "duration", _bucket(duration), 1)
+                    self._incr(bot, "duration_sum", "", duration)
+                    self._incr(bot, "queue_wait", _bucket(queue_wait), 1)
+                    self._incr(bot, "queue_wait_sum", "", queue_wait)
+                self.conn.execute("DELETE FROM runs WHERE start < ?",
+                                  (start - HISTORY_DAYS * 86400, ))
+            finally:
+                self.conn.execute("COMMIT")
+
+    def runs(self, bot: str, since: Optional[float] = None) -> List[Run]:
+        """Gets the recorded runs of one bot, oldest first."""
+
+        with self.lock:
+            return self.conn.execute(
+                "SELECT * FROM runs WHERE bot = ? AND start >= ? "
+                "ORDER BY start", (bot, since or 0.0)).fetchall()
+
+    def counters(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        """Gets the counters, keyed by (bot, name), then by label."""
+
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT bot, name, label, val FROM counters").fetchall()
+        counters: Dict[Tuple[str, str], Dict[str, float]] = {}
+        for bot, name, label, val in rows:
+            counters.setdefault((bot, name), {})[label] = val
+        return counters
+
+
+def _render_histogram(
+    counters: Dict[Tuple[str, str], Dict[str, float]],
+    bots: List[str],
+    name: str,
+    metric: str,
+    help: str,
+) -> Iterator[str]:
+    yield f"# HELP {metric} {help}"
+    yield f"# TYPE {metric} histogram"
+    for bot in bots:
+        buckets = counters.get((bot, name))
+        if not buckets:
+            continue
+        total = 0.0
+        for le in BUCKETS:
+            le_str = "+Inf" if math.isinf(le) else repr(le)
+            total += buckets.get(le_str, 0)
+            yield f"{metric}_bucket{{{_labels(bot=bot, le=le_str)}}} {total:g}"
+        val_sum = counters.get((bot, f"{name}_sum"), {}).get("", 0.0)
+        yield f"{metric}_sum{{{_labels(bot=bot)}}} {val_sum:g}"
+        yield f"{metric}_count{{{_labels(bot=bot)}}} {total:g}"
+
+
+def render(history: RunHistory) -> str:
+    """Renders the metrics in the Prometheus text format.
+
+    Args:
+        history: The run history to render
+
+    Returns:
+        The metrics page
+    """
+
+    counters = history.counters()
+    bots = sorted({bot for bot, _ in counters})
+    lines: List[str] = []
+
+    def counter(name: str, metric: str, label: Optional[str],
+                help: str) -> None:
+        lines.append(f"# HELP {metric} {help}")
+        lines.append(f"# TYPE {metric} counter")
+        for bot in bots:
+            for key, val in sorted(counters.get((bot, name), {}).items()):
+                labels = _labels(bot=bot, **({label: key} if label else {}))
+                lines.append(f"{metric}{{{labels}}} {val:g}")
+
+    counter("runs", "bots_runs_total", "outcome", "Number of runs by outcome.")
+    counter("exceptions", "bots_exceptions_total", "exception",
+            "Number of failed runs by exception type.")
+    counter("rows", "bots_rows_written_total", None,
+            "Number of rows written, for backends that report it.")
+    lines.extend(
+        _render_histogram(counters, bots, "duration",
+                          "bots_run_duration_seconds", "Run duration."))
+    lines.extend(
+        _render_histogram(counters, bots, "queue_wait",
+                          "bots_queue_wait_seconds",
+                          "Time from the start of the run to the bot "
+                          "starting, including waiting on dependencies."))
+    return "\n".join(lines) + "\n"
+
+
+class _Metrics:
+    """Provides access to the run history.
+
+    The history is opened on first access, so importing this module does no
+    IO. Recording never raises, so that metrics can't fail a run.
+    """
+
+    def __init__(self) -> None:
+        self._history: Optional[RunHistory] = None
+        self._lock = threading.Lock()
+
+    @property
+    def history(self) -> RunHistory:
+        if self._history is None:
+            with self._lock:
+                if self._history is None:
+                    self._history = RunHistory(_Metrics.path())
+        return self._history
+
+    @staticmethod
+    @functools.lru_cache(None)
+    def path() -> Path:
+        if "BOTS_METRICS_CONFIG" in os.environ:
+            path = Path(os.environ["BOTS_METRICS_CONFIG"])
+        else:
+            path = Path("~/.config").expanduser() / "bots" / "metrics.db"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def record(
+        self,
+        bot: str,
+        queue_wait: float,
+        duration: float,
+        outcome: str,
+        exception: Optional[str] = None,
+        rows: Optional[int] = None,
+    ) -> None:
+        try:
+            self.history.record((bot, time.time(), queue_wait, duration,
+                                 outcome, exception, rows))
+        except Exception:
+            logger.exception("Couldn't record metrics for %s", bot)
+
+    def render(self) -> str:
+        return render(self.history)
+
+
+METRICS = _Metrics()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+"""Profiles bots one at a time, while they share an event loop.
+
+A CPU profiler attached to the whole process would mix together every bot
+running on the loop. Instead, each backend's `run` coroutine is driven by a
+wrapper which enables that bot's profiler only while one of its own steps
+is executing, so time spent in other bots' steps isn't counted.
+
+While a step runs, a context variable names its bot. A task factory on the
+loop wraps the tasks created during the step, for example by
+`asyncio.gather`, the same way, and the loop's default executor profiles
+the functions submitted during the step, for example by `run_in_executor`,
+on their worker thread. Blocking backends are profiled on their worker
+thread too. Work handed to executors other than the default one isn't
+attributed.
+
+Memory is tracked with `tracemalloc`, which is process-wide, by comparing
+snapshots taken when a bot starts and finishes. Allocations made by other
+bots running at the same time are included, so use `--max-concurrency 1`
+when exact memory attribution matters.
+"""
+
+import argparse
+import asyncio
+import contextvars
+import cProfile
+import functools
+import io
+import logging
+import pstats
+import threading
+import tracemalloc
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Coroutine, Dict, Generator, List, Optional, \
+    Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# The profiler and bot of the coroutine step which is running, if any.
+_CURRENT: "contextvars.ContextVar[Optional[Tuple[Profiler, str]]]" = \
+    contextvars.ContextVar("bots_profiling_current", default=None)
+
+
+class _ProfiledCoroutine:
+    """Runs a coroutine, profiling only its own steps."""
+
+    def __init__(self, coro: Coroutine[Any, Any, Any],
+                 profile: cProfile.Profile,
+                 current: Tuple["Profiler", str]) -> None:
+        self.coro = coro
+        self.profile = profile
+        self.current = current
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        value: Any = None
+        exc: Optional[BaseException] = None
+        while True:
+            token = _CURRENT.set(self.current)
+            self.profile.enable()
+            try:
+                if exc is None:
+                    yielded = self.coro.send(value)
+                else:
+                    yielded = self.coro.throw(exc)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profile.disable()
+                _CURRENT.reset(token)
+            try:
+                value, exc = (yield yielded), None
+            except BaseException as e:
+                value, exc = None, e
+
+
+class _ProfilingExecutor(ThreadPoolExecutor):
+    """Profiles the functions submitted during a profiled step."""
+
+    def submit(self, __fn: Callable[..., T], *args: Any,
+               **kwargs: Any) -> "Future[T]":
+        current = _CURRENT.get()
+        if current is None:
+            return super().submit(__fn, *args, **kwargs)
+        profiler, name = current
+        return super().submit(
+            profiler.wrap_blocking(name,
+                                   functools.partial(__fn, *args, **kwargs)))
+
+
+class Profiler:
+    """Collects a CPU profile, and optionally allocations, for each bot.
+
+    Profiles accumulate over every run of a bot. After each run, the CPU
+    profile is written to `<output_dir>/<bot>.prof`, which can be opened
+    with `pstats` or `snakeviz`. Steps on the event loop share one profile
+    per bot; each function run on a worker thread gets its own profile,
+    since a profile can't be used by two threads at once, and is merged
+    into the bot's stats when it returns.
+
+    Args:
+        output_dir: Where to write the profiles
+        top: How many functions and allocation sites to summarize
+        memory: If set, also track allocations with `tracemalloc`
+    """
+
+    def __init__(self, output_dir: Path, top: int = 20,
+                 memory: bool = False) -> None:
+        self.output_dir = output_dir
+        self.top = top
+        self.memory = memory
+        self.lock = threading.Lock()
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self.thread_stats: Dict[str, pstats.Stats] = {}
+        self.loops: "weakref.WeakSet[asyncio.AbstractEventLoop]" = \
+            weakref.WeakSet()
+        self.snapshots: Dict[str, tracemalloc.Snapshot] = {}
+        self.allocations: Dict[str, List[tracemalloc.StatisticDiff]] = {}
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+
+    def _profile(self, name: str) -> cProfile.Profile:
+        with self.lock:
+            if name not in self.profiles:
+                self.profiles[name] = cProfile.Profile()
+            return self.profiles[name]
+
+    def start(self, name: str) -> None:
+        if self.memory:
+            self.snapshots[name] = tracemalloc.take_snapshot()
+
+    def install(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Attributes tasks and default-executor jobs to the bot creating them.
+
+        Each loop is only set up once; an existing task factory is kept, and
+        called with the wrapped coroutines.
+        """
+
+        if loop in self.loops:
+            return
+        self.loops.add(loop)
+        previous = loop.get_task_factory()
+
+        # Older Pythons may also pass generator-based coroutines.
+        def task_factory(loop: asyncio.AbstractEventLoop, coro: Any,
+                         **kwargs: Any) -> "asyncio.Future[Any]":
+            current = _CURRENT.get()
+            if current is not None:
+                coro = self._wrap_task(coro, current)
+            if previous is not None:
+                return previous(loop, coro, **kwargs)
+            return asyncio.Task(coro, loop=loop, **kwargs)
+
+        loop.set_task_factory(task_factory)
+        loop.set_default_executor(_ProfilingExecutor())
+
+    async def _wrap_task(self, coro: Coroutine[Any, Any, T],
+                         current: Tuple["Profiler", str]) -> T:
+        return await _ProfiledCoroutine(coro, self._profile(current[1]),
+                                        current)
+
+    def wrap(self, name: str, coro: Coroutine[Any, Any, T]) -> Any:
+        """Wraps a backend's coroutine so that only its steps are profiled.
+
+        This should be called on the loop which runs the coroutine, so that
+        the tasks and executor jobs it starts are profiled too.
+        """
+
+        self.install(asyncio.get_running_loop())
+        return _ProfiledCoroutine(coro, self._profile(name), (self, name))
+
+    def wrap_blocking(self, name: str,
+                      fn: Callable[[], T]) -> Callable[[], T]:
+        """Wraps a function run on a worker thread."""
+
+        def _wrapped() -> T:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                logger.warning("Another profiler is active; not profiling "
+                               "%s", name)
+                return fn()
+            try:
+                return fn()
+            finally:
+                profile.disable()
+                stats = pstats.Stats(profile)
+                with self.lock:
+                    if name in self.thread_stats:
+                        self.thread_stats[name].add(stats)
+                    else:
+                        self.thread_stats[name] = stats
+
+        return _wrapped
+
+    def stats(self, name: str, stream: Optional[io.StringIO] = None,
+              ) -> pstats.Stats:
+        """Merges the bot's event loop and worker thread profiles."""
+
+        stats = pstats.Stats(stream=stream)
+        with self.lock:
+            if name in self.profiles:
+                stats.add(self.profiles[name])
+            if name in self.thread_stats:
+                stats.add(self.thread_stats[name])
+        return stats
+
+    def finish(self, name: str) -> None:
+        """Writes the profile of a bot, after it finished running."""
+
+        if name not in self.names:
+            return
+        if self.memory and name in self.snapshots:
+            filters = [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, pstats.__file__),
+                tracemalloc.Filter(False, __file__),
+            ]
+            before = self.snapshots.pop(name).filter_traces(filters)
+            after = tracemalloc.take_snapshot().filter_traces(filters)
+            self.allocations[name] = after.compare_to(before, "lineno")
+        self.stats(name).dump_stats(str(self.output_dir / f"{name}.prof"))
+
+    def summary(self, name: str) -> str:
+        """Gets the hottest functions and allocation sites of a bot."""
+
+        if name not in self.names:
+            return f"No profile for {name}"
+        out = io.StringIO()
+        out.write(f"Profile for {name} "
+                  f"({self.output_dir / f'{name}.prof'}):\n")
+        stats = self.stats(name, out)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(self.top)
+        if name in self.allocations:
+            out.write(f"Top {self.top} allocation sites for {name}:\n")
+            for stat in self.allocations[name][:self.top]:
+                out.write(f"    {stat}\n")
+        return out.getvalue()
+
+    @property
+    def names(self) -> List[str]:
+        with self.lock:
+            return list(dict.fromkeys([*self.profiles, *self.thread_stats]))
+
+
+def add_profile_args(parser: argparse.ArgumentParser) -> None:
+    """Adds the profiling options to an entry point's arguments."""
+
+    parser.add_argument("--profile", action="store_true",
+                        help="If set, profile each bot separately")
+    parser.add_argument("--profile-dir", type=Path, default=Path("profiles"),
+                        help="Where to write the per-bot profiles")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="If set, also track allocations")
+    parser.add_argument("--profile-top", type=int, default=20,
+                        help="Number of functions to summarize per bot")
+
+
+def get_profiler(args: argparse.Namespace) -> Optional[Profiler]:
+    if not args.profile:
+        return None
+    return Profiler(args.profile_dir, args.profile_top, args.profile_memory)
@@ -1,39 +1,307 @@
 #!/usr/bin/env python
 
 import asyncio
+import enum
+import functools
+import json
 import logging
-from typing import Dict, List, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Type
 
-from bots.config import parse_config
+from bots.backends.base import BaseBackend
+from bots.config import build_backends, check_dependencies, read_config
+from bots.dag import critical_path, expand
+from bots.http_client import close_client
+from bots.metrics import METRICS
+from bots.profiling import Profiler
+from bots.state import STATE
 
 logger = logging.getLogger(__name__)
 
 
-async def run_one(
-    bot: str,
-    locks: Optional[Dict[str, asyncio.Event]] = None,
+class Outcome(enum.Enum):
+    success = "success"
+    failed = "failed"
+    timeout = "timeout"
+    skipped = "skipped"
+    unchanged = "unchanged"
+
+    @property
+    def ok(self) -> bool:
+        """If the bot's dependents can run."""
+
+        return self in (Outcome.success, Outcome.unchanged)
+
+
+async def _run_and_publish(backend: BaseBackend) -> None:
+    with backend.in_use():
+        await backend.run()
+        version = backend.output_version()
+    if version is not None:
+        STATE.set(backend.name, "output_version", version)
+
+
+async def _run_and_close(backend: BaseBackend) -> None:
+    try:
+        await _run_and_publish(backend)
+    finally:
+        await close_client()
+
+
+def _run_blocking(backend: BaseBackend) -> None:
+    try:
+        asyncio.run(_run_and_close(backend))
+    finally:
+        backend.close()
+
+
+async def _run_backend(
+    backend: BaseBackend,
+    executor: Optional[ThreadPoolExecutor] = None,
+    profiler: Optional[Profiler] = None,
 ) -> None:
-    backends = parse_config()
-    if bot not in backends:
-        available = list(backends.keys())
-        logger.warning("Bot not found: %s. Available: %s", bot, available)
+    awaitable: Awaitable[None]
+    if backend.blocking:
+        loop = asyncio.get_running_loop()
+        run_fn = functools.partial(_run_blocking, backend)
+        job: Callable[[], None] = run_fn if profiler is None else \
+            profiler.wrap_blocking(backend.name, run_fn)
+        awaitable = loop.run_in_executor(executor, job)
+    elif profiler is not None:
+        awaitable = profiler.wrap(backend.name, _run_and_publish(backend))
+    else:
+        awaitable = _run_and_publish(backend)
+
+    try:
+        await asyncio.wait_for(awaitable, backend.timeout)
+    except asyncio.TimeoutError:
+        if backend.blocking:
+            logger.error("%s timed out after %.1f seconds; its worker thread "
+                         "is left running", backend.name, backend.timeout)
+        else:
+            logger.error("%s timed out after %.1f seconds", backend.name,
+                         backend.timeout)
+        raise
+
+
+async def run_one(
+    backend: BaseBackend,
+    executor: Optional[ThreadPoolExecutor] = None,
+    queue_wait: float = 0.0,
+    profiler: Optional[Profiler] = None,
+) -> Outcome:
+    """Runs a single backend, recording how long it took.
+
+    Args:
+        backend: The backend to run
+        executor: The executor for blocking backends
+        queue_wait: How long the backend waited to start, from the start of
+            the run, including waiting on its dependencies
+        profiler: If set, profiles the run
+
+    Returns:
+        The outcome of the run
+    """
+
+    versions = _input_versions(backend)
+    if _inputs_unchanged(backend, versions):
+        logger.info("Inputs of %s haven't changed; skipping", backend.name)
+        METRICS.record(backend.name, queue_wait, 0.0, Outcome.unchanged.value)
+        return Outcome.unchanged
+
+    logger.info("Running %s", backend.name)
+    backend.rows_written = None
+    exception: Optional[str] = None
+    if profiler is not None:
+        profiler.start(backend.name)
+    start = time.monotonic()
+    try:
+        await _run_backend(backend, executor, profiler)
+        outcome = Outcome.success
+    except asyncio.TimeoutError:
+        outcome = Outcome.timeout
+    except Exception as exp:
+        logger.exception("Got exception while running %s", backend.name)
+        outcome, exception = Outcome.failed, type(exp).__name__
+    finally:
+        if not backend.blocking:
+            backend.close()
+        if profiler is not None:
+            profiler.finish(backend.name)
+    duration = time.monotonic() - start
+    if outcome == Outcome.success:
+        STATE.set(backend.name, "last_duration", f"{duration:.3f}")
+        if backend.inputs:
+            STATE.set(backend.name, "input_versions", json.dumps(versions))
+    METRICS.record(backend.name, queue_wait, duration, outcome.value,
+                   exception, backend.rows_written)
+    return outcome
+
+
+def _input_versions(backend: BaseBackend) -> Dict[str, Optional[str]]:
+    return {
+        name: STATE.get(name, "output_version", default=None)
+        for name in backend.inputs
+    }
+
+
+def _inputs_unchanged(
+    backend: BaseBackend,
+    versions: Dict[str, Optional[str]],
+) -> bool:
+    if not backend.inputs or any(v is None for v in versions.values()):
+        return False
+    last_versions = STATE.get(backend.name, "input_versions", default=None)
+    return last_versions is not None and json.loads(last_versions) == versions
+
+
+def _expected_duration(bot: str) -> float:
+    duration = STATE.get(bot, "last_duration", default=None)
+    return 1.0 if duration is None else float(duration)
+
+
+async def run(
+    bots: List[str],
+    max_concurrency: Optional[int] = None,
+    include_dependencies: bool = False,
+    backends: Optional[Dict[str, BaseBackend]] = None,
+    profiler: Optional[Profiler] = None,
+) -> Dict[str, Outcome]:
+    """Runs the bots concurrently, respecting their dependencies.
+
+    Bots are started as soon as everything they depend on has succeeded.
+    A bot which declares `inputs` is not run if none of their published
+    output versions changed since its last successful run; its outcome is
+    then `unchanged`, and its dependents still run.
+    When several bots are ready, the ones at the head of the longest chain
+    of dependents (by their last run time) are started first. If a bot
+    fails, everything downstream of it is skipped. Blocking backends are
+    run on a thread pool, so that they don't hold up the other bots.
+
+    Args:
+        bots: The names of the bots to run
+        max_concurrency: The maximum number of bots to run at once
+        include_dependencies: If set, also run the dependencies of the
+            bots which weren't requested; otherwise, those dependencies are
+            assumed to be satisfied
+        backends: The backends to look the bots up in; if not given, only
+            the bots which are run are built from the config
+        profiler: If set, profiles each bot separately
+
+    Returns:
+        The outcome of each bot
+    """
+
+    if backends is None:
+        config = read_config()
+        all_depends = check_dependencies(config)
+    else:
+        all_depends = {k: v.depends for k, v in backends.items()}
+    missing = [bot for bot in bots if bot not in all_depends]
+    if missing:
+        available = list(all_depends.keys())
+        logger.warning("Bots not found: %s. Available: %s", missing, available)
+        bots = [bot for bot in bots if bot in all_depends]
+
+    if include_dependencies:
+        bots = expand(bots, all_depends)
+    if backends is None:
+        backends = build_backends(config, bots)
+        bots = [bot for bot in bots if bot in backends]
+    depends = {bot: [d for d in all_depends[bot] if d in bots] for bot in bots}
+    for bot in bots:
+        for dep in all_depends[bot]:
+            if dep not in depends:
+                logger.info("%s depends on %s, which wasn't requested", bot,
+                            dep)
+
+    priority = critical_path(depends, {b: _expected_duration(b) for b in bots})
+    dependents: Dict[str, List[str]] = {bot: [] for bot in bots}
+    for bot, deps in depends.items():
+        for dep in deps:
+            dependents[dep].append(bot)
+    waiting = {bot: len(deps) for bot, deps in depends.items()}
+    ready = [bot for bot in bots if not waiting[bot]]
+    run_start = time.monotonic()
+    outcomes: Dict[str, Outcome] = {}
+    running: Dict["asyncio.Task[Outcome]", str] = {}
+    running_types: Dict[Type[BaseBackend], int] = {}
+
+    def skip(bot: str, reason: str) -> None:
+        for dependent in dependents[bot]:
+            if dependent not in outcomes:
+                logger.warning("Skipping %s, since %s %s", dependent, bot,
+                               reason)
+                outcomes[dependent] = Outcome.skipped
+                METRICS.record(dependent, 0.0, 0.0, Outcome.skipped.value)
+                skip(dependent, "was skipped")
+
+    def has_capacity(bot: str) -> bool:
+        if max_concurrency is not None and len(running) >= max_concurrency:
+            return False
+        backend_type = type(backends[bot])
+        if backend_type.max_concurrency is None:
+            return True
+        num_running = running_types.get(backend_type, 0)
+        return num_running < backend_type.max_concurrency
+
+    executor = ThreadPoolExecutor(max_concurrency or max(len(bots), 1))
+    try:
+        while ready or running:
+            ready.sort(key=lambda b: priority[b], reverse=True)
+            started: Set[str] = set()
+            for bot in ready:
+                if not has_capacity(bot):
+                    continue
+                queue_wait = time.monotonic() - run_start
+                task = asyncio.create_task(
+                    run_one(backends[bot], executor, queue_wait, profiler))
+                running[task] = bot
+                backend_type = type(backends[bot])
+                running_types[backend_type] = \
+                    running_types.get(backend_type, 0) + 1
+                started.add(bot)
+            ready = [bot for bot in ready if bot not in started]
 
-    for depends in backends[bot].depends:
-        if locks is not None and depends in locks:
-            await locks[depends].wait()
+            done, _ = await asyncio.wait(running,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                bot = running.pop(task)
+                running_types[type(backends[bot])] -= 1
+                outcomes[bot] = task.result()
+                if not outcomes[bot].ok:
+                    skip(bot, f"finished with outcome {outcomes[bot].value}")
+                    continue
+                for dependent in dependents[bot]:
+                    waiting[dependent] -= 1
+                    if not waiting[dependent] and dependent not in outcomes:
+                        ready.append(dependent)
+    finally:
+        # If the run was cancelled, stops the bots which are still running.
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        # Doesn't wait, since timed out blocking runs can't be interrupted.
+        executor.shutdown(wait=False)
 
-    logger.info("Running %s", bot)
-    await backends[bot].run()
-    if locks is not None and bot in locks:
-        locks[bot].set()
+    return outcomes
 
 
-async def run(bots: List[str]) -> None:
-    locks = {bot: asyncio.Event() for bot in bots}
-    tasks = [asyncio.create_task(run_one(bot, locks)) for bot in bots]
-    for task in tasks:
-        await task
+def run_sync(
+    bots: List[str],
+    max_concurrency: Optional[int] = None,
+    include_dependencies: bool = False,
+    backends: Optional[Dict[str, BaseBackend]] = None,
+    profiler: Optional[Profiler] = None,
+) -> Dict[str, Outcome]:
 
+    async def _run() -> Dict[str, Outcome]:
+        try:
+            return await run(bots, max_concurrency, include_dependencies,
+                             backends, profiler)
+        finally:
+            await close_client()
 
-def run_sync(bots: List[str]) -> None:
-    asyncio.run(run(bots))
+    return asyncio.run(_run())
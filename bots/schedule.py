@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import calendar
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+MONTH_NAMES = {
+    name.lower(): i for i, name in enumerate(calendar.month_abbr) if name
+}
+
+DAY_NAMES = {
+    name.lower(): (i + 1) % 7 for i, name in enumerate(calendar.day_abbr)
+}
+
+ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+# Maximum number of days to search forward for the next match, so that
+# impossible expressions like `0 0 31 2 *` don't loop forever.
+MAX_SEARCH_DAYS = 366 * 5
+
+
+def _parse_value(value: str, names: Dict[str, int]) -> int:
+    value = value.lower()
+    if value in names:
+        return names[value]
+    return int(value)
+
+
+def _parse_field(
+    field: str,
+    lo: int,
+    hi: int,
+    names: Optional[Dict[str, int]] = None,
+) -> Set[int]:
+    """Parses one field of a cron expression into the set of matches."""
+
+    names = names or {}
+    values: Set[int] = set()
+    for part in field.split(","):
+        rng, _, step_str = part.partition("/")
+        step = int(step_str) if step_str else 1
+        if step < 1:
+            raise ValueError(f"Invalid step in cron field: {field}")
+        if rng == "*":
+            start, end = lo, hi
+        elif "-" in rng:
+            start_str, end_str = rng.split("-", 1)
+            start, end = _parse_value(start_str, names), \
+                _parse_value(end_str, names)
+        else:
+            start = _parse_value(rng, names)
+            end = hi if step_str else start
+        if not lo <= start <= end <= hi:
+            raise ValueError(f"Cron field out of range [{lo}, {hi}]: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """Parses a standard five-field cron expression.
+
+    The fields are minute, hour, day of month, month and day of week, and
+    support `*`, ranges (`9-17`), steps (`*/5`, `0-30/10`), lists (`1,15`)
+    and three-letter month and day names. As in cron, if both the day of
+    month and day of week are restricted, a day matching either one fires.
+    The `@hourly`-style aliases are also supported.
+    """
+
+    def __init__(self, expression: str) -> None:
+        self.expression = expression
+        fields = ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression should have 5 fields: "
+                             f"{expression}")
+        minute, hour, dom, month, dow = fields
+
+        self.minutes = _parse_field(minute, 0, 59)
+        self.hours = _parse_field(hour, 0, 23)
+        self.days = _parse_field(dom, 1, 31)
+        self.months = _parse_field(month, 1, 12, MONTH_NAMES)
+        # Both 0 and 7 are Sunday.
+        self.weekdays = {d % 7 for d in _parse_field(dow, 0, 7, DAY_NAMES)}
+
+        self.any_day = dom == "*"
+        self.any_weekday = dow == "*"
+
+        self.sorted_minutes: List[int] = sorted(self.minutes)
+        self.sorted_hours: List[int] = sorted(self.hours)
+
+    def _matches_day(self, t: datetime) -> bool:
+        if t.month not in self.months:
+            return False
+        day_match = t.day in self.days
+        weekday_match = (t.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return weekday_match
+        if self.any_weekday:
+            return day_match
+        return day_match or weekday_match
+
+    def next_after(self, t: datetime) -> datetime:
+        """Gets the first matching minute strictly after `t`."""
+
+        t = t.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = t.replace(hour=0, minute=0)
+        for _ in range(MAX_SEARCH_DAYS):
+            if self._matches_day(day):
+                for hour in self.sorted_hours:
+                    if day == t.replace(hour=0, minute=0) and hour < t.hour:
+                        continue
+                    for minute in self.sorted_minutes:
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= t:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"Cron expression never matches: {self.expression}")
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CronExpression):
+            return NotImplemented
+        return self.expression == other.expression
+
+    def __hash__(self) -> int:
+        return hash(self.expression)
+
+    def __repr__(self) -> str:
+        return f"CronExpression({self.expression!r})"
@@ -1,11 +1,17 @@
 #!/usr/bin/env python
 
 import atexit
+import contextlib
+import fcntl
 import functools
 import json
 import os
+import sqlite3
+import tempfile
+import threading
+from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Dict, Optional, Union
+from typing import Dict, Iterator, Optional, Tuple, Union
 
 
 class _NoDefault:
@@ -14,14 +20,218 @@ class _NoDefault:
 NO_DEFAULT = _NoDefault()
 
 
+class StateBackend(ABC):
+    """Defines the storage interface for the state."""
+
+    @abstractmethod
+    def get(self, task: str, key: str) -> Optional[str]:
+        """Gets a value, or None if it isn't set."""
+
+    @abstractmethod
+    def set(self, task: str, key: str, val: Optional[str]) -> None:
+        """Sets a value, or deletes it if `val` is None."""
+
+    @abstractmethod
+    def compare_and_set(
+        self,
+        task: str,
+        key: str,
+        expected: Optional[str],
+        val: Optional[str],
+    ) -> bool:
+        """Atomically sets a value if it currently equals `expected`.
+
+        Returns:
+            If the value was set
+        """
+
+    def items(self) -> Iterator[Tuple[str, str, str]]:
+        """Iterates over all (task, key, value) tuples."""
+
+        return iter(())
+
+    def save(self) -> None:
+        """Flushes any pending writes."""
+
+
+class SqliteStateBackend(StateBackend):
+    """Stores each key as a row in an SQLite database, in WAL mode.
+
+    Every write is committed immediately, so concurrent processes only
+    conflict on the keys they actually touch.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS state (
+                task text NOT NULL,
+                key text NOT NULL,
+                val text NOT NULL,
+                PRIMARY KEY (task, key)
+            ) WITHOUT ROWID
+        """)
+
+    def get(self, task: str, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT val FROM state WHERE task = ? AND key = ?",
+                (task, key),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def _set(self, task: str, key: str, val: Optional[str]) -> None:
+        if val is None:
+            self.conn.execute("DELETE FROM state WHERE task = ? AND key = ?",
+                              (task, key))
+        else:
+            self.conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?, ?)",
+                              (task, key, val))
+
+    def set(self, task: str, key: str, val: Optional[str]) -> None:
+        with self.lock:
+            self._set(task, key, val)
+
+    def compare_and_set(
+        self,
+        task: str,
+        key: str,
+        expected: Optional[str],
+        val: Optional[str],
+    ) -> bool:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT val FROM state WHERE task = ? AND key = ?",
+                    (task, key),
+                ).fetchone()
+                if (None if row is None else row[0]) != expected:
+                    return False
+                self._set(task, key, val)
+                return True
+            finally:
+                self.conn.execute("COMMIT")
+
+    def items(self) -> Iterator[Tuple[str, str, str]]:
+        with self.lock:
+            rows = self.conn.execute("SELECT task, key, val FROM state")
+            return iter(rows.fetchall())
+
+
+class JsonStateBackend(StateBackend):
+    """Stores the state as a single JSON file.
+
+    Writes are buffered and merged into the file on `save`, under a file
+    lock, so that overlapping processes don't clobber each other's keys.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = self._read()
+        self.dirty: Dict[Tuple[str, str], Optional[str]] = {}
+
+    def _read(self) -> Dict[str, Dict[str, str]]:
+        if not self.path.exists():
+            return {}
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def _write(self) -> None:
+        with tempfile.NamedTemporaryFile("w", dir=self.path.parent,
+                                         delete=False) as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(f.name, self.path)
+
+    @contextlib.contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        with open(self.path.with_suffix(".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _apply(self, task: str, key: str, val: Optional[str]) -> None:
+        if val is None:
+            self.state.get(task, {}).pop(key, None)
+        else:
+            self.state.setdefault(task, {})[key] = val
+
+    def get(self, task: str, key: str) -> Optional[str]:
+        with self.lock:
+            return self.state.get(task, {}).get(key)
+
+    def set(self, task: str, key: str, val: Optional[str]) -> None:
+        with self.lock:
+            self._apply(task, key, val)
+            self.dirty[(task, key)] = val
+
+    def compare_and_set(
+        self,
+        task: str,
+        key: str,
+        expected: Optional[str],
+        val: Optional[str],
+    ) -> bool:
+        with self.lock, self._file_lock():
+            self.state = self._read()
+            for (t, k), v in self.dirty.items():
+                self._apply(t, k, v)
+            if self.state.get(task, {}).get(key) != expected:
+                return False
+            self._apply(task, key, val)
+            self._write()
+            self.dirty.clear()
+            return True
+
+    def items(self) -> Iterator[Tuple[str, str, str]]:
+        with self.lock:
+            return iter([(t, k, v) for t, kvs in self.state.items()
+                         for k, v in kvs.items()])
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            with self._file_lock():
+                self.state = self._read()
+                for (task, key), val in self.dirty.items():
+                    self._apply(task, key, val)
+                self._write()
+            self.dirty.clear()
+
+
 class _State:
-    def __init__(self, state: Dict[str, Dict[str, str]]) -> None:
-        self.state = state
+    """Provides access to the bot state.
+
+    The storage backend is chosen from the state path: paths ending in
+    `.json` use the legacy JSON file, and anything else uses SQLite. The
+    backend is opened on first access, so importing this module does no IO.
+    """
+
+    def __init__(self, backend: Optional[StateBackend] = None) -> None:
+        self._backend = backend
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self) -> StateBackend:
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = _State.open(_State.path())
+        return self._backend
 
     def set(self, task: str, key: str, val: str) -> None:
-        if task not in self.state:
-            self.state[task] = {}
-        self.state[task][key] = val
+        self.backend.set(task, key, val)
+
+    def delete(self, task: str, key: str) -> None:
+        self.backend.set(task, key, None)
 
     def get(
         self,
@@ -29,12 +239,23 @@ class _State:
         key: str,
         default: Optional[Union[str, _NoDefault]] = NO_DEFAULT,
     ) -> Optional[str]:
-        try:
-            return self.state[task][key]
-        except KeyError as e:
+        val = self.backend.get(task, key)
+        if val is None:
             if isinstance(default, _NoDefault):
-                raise e
+                raise KeyError((task, key))
             return default
+        return val
+
+    def compare_and_set(
+        self,
+        task: str,
+        key: str,
+        expected: Optional[str],
+        val: Optional[str],
+    ) -> bool:
+        """Sets the value if it is currently `expected` (None if unset)."""
+
+        return self.backend.compare_and_set(task, key, expected, val)
 
     @staticmethod
     @functools.lru_cache(None)
@@ -42,22 +263,28 @@ class _State:
         if "BOTS_STATE_CONFIG" in os.environ:
             path = Path(os.environ["BOTS_STATE_CONFIG"])
         else:
-            path = Path("~/.config").expanduser() / "bots" / "state.json"
+            path = Path("~/.config").expanduser() / "bots" / "state.db"
         path.parent.mkdir(parents=True, exist_ok=True)
         return path
 
-    @classmethod
-    def load(cls) -> "State":
-        if not _State.path().exists():
-            return cls({})
-        with open(_State.path(), "r") as f:
-            state = json.load(f)
-        return cls(state)
+    @staticmethod
+    def open(path: Path) -> StateBackend:
+        if path.suffix == ".json":
+            return JsonStateBackend(path)
+
+        # Imports the legacy JSON state the first time SQLite is used.
+        legacy_path = path.with_suffix(".json")
+        is_new = not path.exists()
+        backend = SqliteStateBackend(path)
+        if is_new and legacy_path.exists():
+            for task, key, val in JsonStateBackend(legacy_path).items():
+                backend.set(task, key, val)
+        return backend
 
     def save(self) -> None:
-        with open(_State.path(), "w") as f:
-            json.dump(self.state, f, indent=2)
+        if self._backend is not None:
+            self._backend.save()
 
 
-STATE = _State.load()
+STATE = _State()
 atexit.register(STATE.save)
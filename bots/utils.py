@@ -20,3 +20,15 @@ class Time:
         if t is None:
             t = datetime.now()
         return t.strftime(Time.FORMAT)
+
+    @staticmethod
+    def epoch(t: Optional[datetime] = None) -> int:
+        """Gets integer seconds since the epoch, for SQLite."""
+
+        if t is None:
+            t = datetime.now()
+        return int(t.timestamp())
+
+    @staticmethod
+    def from_epoch(t: int) -> datetime:
+        return datetime.fromtimestamp(t)
@@ -23,6 +23,8 @@ setup(
         "termcolor",
         "coloredlogs",
         "lxml",
+        "aiohttp",
+        "numpy",
         "flask",
         "gunicorn",
     ],